@@ -0,0 +1,258 @@
+"""
+Benchmarks for macro construction, wiring, serialization and throughput.
+
+Results are written as JSON, so that they can be compared between releases:
+
+    python benchmarks/run.py --out results.json
+    python benchmarks/run.py --out new.json --compare results.json
+
+Use --quick for a fast smoke run with small sizes and few repeats.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import statistics
+import tempfile
+from importlib import metadata
+
+import numpy as np
+import yaml
+
+from livenodes import Graph, Node
+from ln_io_python.in_python import In_python
+from ln_io_python.out_python import Out_python
+from ln_macro import Macro, MacroGraph, Noop, template_cache
+
+
+# --- Helper nodes ----------------
+class Stamp(Noop):
+    # replaces the sample with the time it passed, so that the latency can be computed at the end of the chain
+    passthrough = False
+
+    def process(self, any, **kwargs):
+        return self.ret(any=time.perf_counter())
+
+class Latency(Noop):
+    passthrough = False
+
+    def process(self, any, **kwargs):
+        return self.ret(any=time.perf_counter() - any)
+
+
+# --- Macro files ----------------
+def write_chain(folder, n):
+    """Macro file with a linear chain of n Noops."""
+    path = os.path.join(folder, f"chain_{n}.yml")
+    if not os.path.exists(path):
+        dct = {
+            "Inputs": [f"Noop{i} [Noop].any -> Noop{i + 1} [Noop].any" for i in range(n - 1)],
+            "Nodes": {f"Noop{i} [Noop]": {"compute_on": "", "name": f"Noop{i}"} for i in range(n)},
+        }
+        with open(path, 'w') as f:
+            yaml.dump(dct, f)
+    return path
+
+def write_nested(folder, n, depth):
+    """Macro file wrapping a chain of n Noops in depth levels of macros."""
+    path = write_chain(folder, n)
+    for d in range(depth):
+        inner, path = path, os.path.join(folder, f"nested_{n}_{d + 1}.yml")
+        name = f"Inner{d}"
+        dct = {
+            "Inputs": [f"Head [Noop].any -> {name} [Macro].{Macro(path=inner).ports_in._fields[0]}"],
+            "Nodes": {
+                "Head [Noop]": {"compute_on": "", "name": "Head"},
+                f"{name} [Macro]": {"compute_on": "", "name": name, "path": inner},
+            },
+        }
+        with open(path, 'w') as f:
+            yaml.dump(dct, f)
+    return path
+
+def last_port(macro):
+    return getattr(macro.ports_out, macro.ports_out._fields[0])
+
+
+# --- Measurements ----------------
+def measure(fn, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+        start = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - start)
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.mean(times),
+        "max": max(times),
+        "repeat": repeat,
+    }
+
+def bench_construction(folder, sizes, repeat):
+    for n in sizes:
+        path = write_chain(folder, n)
+        # the first call parses the file, which is cached afterwards
+        template_cache.invalidate()
+        yield "construction_cold", {"nodes": n}, measure(lambda: Macro(path=path), 1)
+        yield "construction", {"nodes": n}, measure(lambda: Macro(path=path), repeat)
+
+def bench_wiring(folder, counts, repeat):
+    path = write_chain(folder, 2)
+    for n in counts:
+        def setup():
+            in_python = In_python(data=[0])
+            prev, port = in_python, in_python.ports_out.any
+            for _ in range(n):
+                m = Macro(path=path)
+                m.add_input(prev, emit_port=port, recv_port=m.ports_in.Noop0_any)
+                prev, port = m, m.ports_out.Noop1_any
+            return prev, port, Macro(path=path)
+
+        def connect(prev, port, m):
+            m.add_input(prev, emit_port=port, recv_port=m.ports_in.Noop0_any)
+            m.remove_all_inputs()
+        yield "add_remove_input", {"macros": n}, measure(connect, repeat, setup=setup)
+
+def build_graph(folder, n_macros, nested=0, data=[0]):
+    path = write_nested(folder, 3, nested) if nested > 0 else write_chain(folder, 3)
+    in_python = In_python(data=data)
+    prev, port = in_python, in_python.ports_out.any
+    for _ in range(n_macros):
+        m = Macro(path=path)
+        m.add_input(prev, emit_port=port, recv_port=getattr(m.ports_in, m.ports_in._fields[0]))
+        prev, port = m, last_port(m)
+    out_python = Out_python()
+    out_python.add_input(prev, emit_port=port, recv_port=out_python.ports_in.any)
+    return in_python, out_python
+
+def bench_serialization(folder, counts, repeat, nested=(0, 2)):
+    for n in counts:
+        for depth in nested:
+            in_python, _ = build_graph(folder, n, nested=depth)
+            dct = in_python.to_compact_dict(graph=True)
+            params = {"macros": n, "nested": depth}
+            yield "to_compact_dict", params, measure(lambda: in_python.to_compact_dict(graph=True), repeat)
+            yield "from_compact_dict", params, measure(lambda: Node.from_compact_dict(dct), repeat)
+
+def run_chain(head, tail, graph_cls):
+    g = graph_cls(start_node=head)
+    start = time.perf_counter()
+    g.start_all()
+    g.join_all()
+    duration = time.perf_counter() - start
+    g.stop_all()
+    return duration
+
+def bench_throughput(folder, n_nodes, n_samples, repeat):
+    data = list(np.arange(n_samples))
+    path = write_chain(folder, n_nodes)
+
+    def flat():
+        in_python, stamp, latency, out_python = In_python(data=data), Stamp(name="Stamp"), Latency(name="Latency"), Out_python()
+        stamp.add_input(in_python, emit_port=in_python.ports_out.any, recv_port=stamp.ports_in.any)
+        prev = stamp
+        for i in range(n_nodes):
+            n = Noop(name=f"Noop{i}")
+            n.add_input(prev, emit_port=prev.ports_out.any, recv_port=n.ports_in.any)
+            prev = n
+        latency.add_input(prev, emit_port=prev.ports_out.any, recv_port=latency.ports_in.any)
+        out_python.add_input(latency, emit_port=latency.ports_out.any, recv_port=out_python.ports_in.any)
+        return in_python, out_python
+
+    def macro():
+        in_python, stamp, latency, out_python = In_python(data=data), Stamp(name="Stamp"), Latency(name="Latency"), Out_python()
+        stamp.add_input(in_python, emit_port=in_python.ports_out.any, recv_port=stamp.ports_in.any)
+        m = Macro(path=path)
+        m.add_input(stamp, emit_port=stamp.ports_out.any, recv_port=m.ports_in.Noop0_any)
+        latency.add_input(m, emit_port=getattr(m.ports_out, f"Noop{n_nodes - 1}_any"), recv_port=latency.ports_in.any)
+        out_python.add_input(latency, emit_port=latency.ports_out.any, recv_port=out_python.ports_in.any)
+        return in_python, out_python
+
+    for name, build, graph_cls in [("flat", flat, Graph), ("macro", macro, Graph), ("macro_compiled", macro, MacroGraph)]:
+        durations, latencies = [], []
+        for _ in range(repeat):
+            in_python, out_python = build()
+            durations.append(run_chain(in_python, out_python, graph_cls))
+            latencies.extend(out_python.get_state())
+        params = {"graph": name, "nodes": n_nodes, "samples": n_samples}
+        yield "throughput", params, {
+            "samples_per_sec": n_samples / statistics.median(durations),
+            "latency_median": float(statistics.median(latencies)),
+            "latency_p95": float(np.percentile(latencies, 95)),
+            "repeat": repeat,
+        }
+
+
+# --- Runner ----------------
+def meta():
+    versions = {}
+    for pkg in ["livenodes", "ln_macro", "ln_io_python"]:
+        try:
+            versions[pkg] = metadata.version(pkg)
+        except metadata.PackageNotFoundError:
+            versions[pkg] = None
+    return {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(), "platform": platform.platform(), "versions": versions}
+
+def run(quick=False):
+    # the benchmarks create many macros of the same name on purpose, thus the rename warnings are only noise here
+    logging.getLogger('livenodes').setLevel(logging.ERROR)
+    if quick:
+        sizes, counts, repeat, samples = [2, 8], [2, 8], 2, 50
+    else:
+        sizes, counts, repeat, samples = [2, 8, 32, 128], [2, 8, 32, 128], 10, 2000
+
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        benches = [
+            bench_construction(folder, sizes, repeat),
+            bench_wiring(folder, counts, repeat),
+            bench_serialization(folder, counts, repeat),
+            bench_throughput(folder, 8, samples, max(1, repeat // 5)),
+        ]
+        for bench in benches:
+            for name, params, stats in bench:
+                print(name, params, {k: round(v, 6) if type(v) == float else v for k, v in stats.items()}, file=sys.stderr)
+                results.append({"name": name, "params": params, "stats": stats})
+    return {"meta": meta(), "results": results}
+
+def _key(res):
+    return res["name"], json.dumps(res["params"], sort_keys=True)
+
+def compare(new, old):
+    """Ratio new / old of the main stat of each benchmark present in both, ie > 1 is slower (or higher throughput)."""
+    old_results = {_key(r): r for r in old["results"]}
+    ratios = []
+    for r in new["results"]:
+        o = old_results.get(_key(r))
+        if o is None:
+            continue
+        stat = "samples_per_sec" if "samples_per_sec" in r["stats"] else "median"
+        ratios.append({"name": r["name"], "params": r["params"], "stat": stat, "ratio": r["stats"][stat] / o["stats"][stat]})
+    return ratios
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out', default=None, help='File to write the results to (default: stdout)')
+    parser.add_argument('--compare', default=None, help='Results of a previous run to compare against')
+    parser.add_argument('--quick', action='store_true', help='Small sizes and few repeats')
+    args = parser.parse_args(argv)
+
+    res = run(quick=args.quick)
+    if args.compare is not None:
+        with open(args.compare, 'r') as f:
+            res["compare"] = compare(res, json.load(f))
+
+    if args.out is None:
+        json.dump(res, sys.stdout, indent=2)
+    else:
+        with open(args.out, 'w') as f:
+            json.dump(res, f, indent=2)
+    return res
+
+if __name__ == '__main__':
+    main()
@@ -1,2 +1,5 @@
 from .macro import Macro, MacroHelper
-from .noop import Noop 
\ No newline at end of file
+from .noop import Noop
+from .utils.template_cache import template_cache
+from .runtime import MacroGraph
+from .utils.bulk import bulk_load
@@ -1,6 +1,22 @@
+import copyreg
+from functools import partial
+
 from livenodes import Node, Ports_collection, Connection
 from ln_ports import Ports_empty
 
+from .utils.template_cache import template_cache
+from .utils.names import MacroNameRegistry
+from .utils.manifest import read_manifest, ports_from_manifest
+from .utils.library import library_manifest
+from .utils.membership import MacroMembership, membership
+from .runtime.shm_bridge import isolated_location
+from .runtime.metrics import MacroMetrics
+from .runtime.cache import MacroCache, DEFAULT_MAX_BYTES
+from .runtime.record import MacroRecorder
+from .runtime.fanout import share_call
+from .runtime.place import AUTO, plan_placement
+from .runtime.offline import run_offline
+
 import pathlib
 file_path = pathlib.Path(__file__).parent.resolve()
 
@@ -18,100 +34,491 @@ class MacroHelper(Node, abstract_class=True):
     ports_in = Ports_empty()
     ports_out = Ports_empty()
 
+    # set while a lazy macro's sub-graph is not created yet
+    _lazy = False
+    # set once instrumented, see instrument()
+    _metrics = None
+    # created on first use, see result_cache()
+    _cache = None
+    # set once recorded, see record()
+    _recorder = None
+
     example_init = {
         "path": f"{file_path}/noop.yml",
         "name": "Macro",
     }
 
-    def __init__(self, path, name=None, compute_on="", **kwargs):
-        name = self.name(name, path)
+    # defaults of the opt-in options of __init__, see _settings
+    _option_defaults = {"params": {}, "fuse": False, "isolated": False, "replicas": 1, "replica_key": None, "batch": 1, "batch_latency": None, "lazy": False, "cache": False, "cache_dir": None, "placement": None}
+
+    def __init__(self, path, name=None, compute_on="", params=None, fuse=False, isolated=False, replicas=1, replica_key=None, batch=1, batch_latency=None, lazy=False, cache=False, cache_dir=None, placement=None, **kwargs):
+        name = self.default_name(name, path)
         super().__init__(name, compute_on=compute_on, **kwargs)
 
         self.path = path
+        # values for the ${name} placeholders of the file, variants of the same file share the parsed template and, if their ports match, the class
+        self.params = dict(params or {})
+        # opt-in: linear chains of our children are run as a single node once the graph is compiled (see runtime.MacroGraph)
+        self.fuse = fuse
+        # opt-in: run the whole sub-graph in its own process, data crossing our ports is passed via shared memory (see runtime.Bridge_shm)
+        self.isolated = isolated
+        # opt-in: run k copies of the sub-graph in parallel, samples are distributed round-robin (or by the value on the replica_key port) and merged back in order (see runtime.replicate)
+        self.replicas = replicas
+        self.replica_key = replica_key
+        # opt-in: accumulate up to batch samples (or for batch_latency seconds) and run them through the sub-graph as one array (see runtime.batch)
+        self.batch = batch
+        self.batch_latency = batch_latency
+        # opt-in: outputs are cached per inputs (True or the memory budget in bytes), on a hit the sub-graph is skipped entirely (see runtime.cache)
+        # with cache_dir, entries evicted from memory are kept on disk instead
+        self.cache = cache
+        self.cache_dir = cache_dir
+        # with compute_on="auto" the children are spread over processes based on their measured costs (see place()), placement freezes the result (child name -> location)
+        self.placement = dict(placement) if placement is not None else None
+        if compute_on == AUTO and (isolated or replicas > 1):
+            raise ValueError(f'compute_on="{AUTO}" places the children itself and cannot be combined with isolated or replicas')
+        # opt-in: the sub-graph is only created once it is needed (at the latest when a runtime.MacroGraph is created, a plain Graph refuses to start us, see lock())
+        # until then we are connected and serialized as a node ourselves
+        self.lazy = lazy
+        self._lazy = lazy
+
+        if lazy:
+            self._macro_names = MacroNameRegistry()
+            self.name = self._name
+        else:
+            self._build()
+
+    def _build(self):
+        path = self.path
 
         # --- Load the pipeline ----------------
-        pl = Node.load(path)
+        # the file is parsed once per process, we only create our own instances of the sub-graph nodes here
+        template = self._load_template(path, self.params)
+        pl = template.instantiate(self.params)
         nodes = self._discover_graph_excl_macros(pl)
         
         # Set the compute_on attribute for all nodes 
         for n in nodes:
-            n.compute_on = compute_on
+            n.compute_on = self._child_location(self._child_name(n))
             n.attrs.append(MAttr.macro_child)
 
+        if template.from_manifest and template.ports_key(self.params) == template.ports_key():
+            # the class was created from the manifest, make sure it still describes our sub-graph
+            in_fields, out_fields = self._port_signature(nodes)
+            if [f for f, _ in in_fields] != list(self.ports_in._fields) or [f for f, _ in out_fields] != list(self.ports_out._fields):
+                raise ValueError(f'Port manifest of {path} does not match its sub-graph anymore, please re-write it (see utils.manifest.write_manifest)')
+
         # --- Match Ports ----------------
+        names = {id(n): self._child_name(n) for n in nodes}
+        own_in_port_to_ref, own_out_port_to_ref, own_in_port_reverse, own_out_port_reverse = self._port_maps(nodes, names)
+
+        # --- Set object specifics ----------------
+        self.pl = pl
+        self._nodes = nodes
+        self._own_ids = set(map(id, nodes))
+        # connections between our children and nodes outside the sub-graph, kept up to date by add_input, _add_output and the removal functions
+        self._boundary_in = []
+        self._boundary_out = []
+        # serialized settings and inputs per child, see _compact_entry
+        self._compact_config = None
+        self._compact_cache = {}
+        self.own_in_port_to_ref = own_in_port_to_ref
+        self.own_out_port_to_ref = own_out_port_to_ref
+
+        # --- Membership / Serialization ----------------
+        # There are two main thoughts: (1) how to serialize inputs into the macro and (2) how to serialize nodes the macro inputs to (ie macros output)
+        # (1) The idea for inputs is that each node returns the macro nodes settings as its compact_settings
+        #   because the to_compact_dict method used for serialization overwrites nodes with the same str(node) (which should not occur, as each name must be unique in the graph) we can use that
+        #   to just return the settings of the macro node over and over and not worrying about duplicates in the serialized output
+        #   however, this is not the case for inputs, as they use inputs.extend() and thus we should only return those once
+        # (2) The idea for outputs is that connections from our nodes serialize with the macro instead of the sub-graph node
+        # Both are implemented once per node class (see MacroChild and MacroConnection below) and dispatch on the nodes' membership record, thus the nodes carry no per-instance state besides that record (and stay cheap to copy to other processes)
+        for n in nodes:
+            self._adopt(n, names[id(n)], own_in_port_reverse[id(n)], own_out_port_reverse[id(n)])
+
+        # --- Register Name ----------------
+        # nested macros are not part of the graph we are used in (only we are serialized), thus their names are only unique within their own file and we start a new registry
+        # the registry is only kept on us, children reach it via their membership record (see MacroNameRegistry.lookup)
+        registry = MacroNameRegistry()
+        if '_macro_names' in self.__dict__:
+            # we were lazy and thus may already be part of a graph
+            registry = self._macro_names.find()
+        self._macro_names = registry
+        self.name = self._name
+
+    @property
+    def location(self):
+        # where nodes added for us at compile time run (e.g. runtime.batch), with compute_on="auto" that is next to the rest of the graph
+        return "" if self.compute_on == AUTO else self.compute_on
+
+    def _child_location(self, name):
+        if self.compute_on == AUTO:
+            return (self.placement or {}).get(name, "")
+        # with replicas, the children only move to the first replica's process once the graph is compiled (see runtime.replicate)
+        return isolated_location(self.compute_on, id(self)) if self.isolated else self.compute_on
+
+    def _port_maps(self, nodes, names):
         # Initialize lists for field names and defaults
         own_in_port_to_ref, own_out_port_to_ref = {}, {}
-        own_in_port_reverse, own_out_port_reverse = {}, {}
+        # per node: port key -> our field name, stored in the node's membership record
+        # nodes of nested macros are resolved to our fields here as well, thus all lookups go through a single table no matter how deep they are nested
+        own_in_port_reverse, own_out_port_reverse = {id(n): {} for n in nodes}, {id(n): {} for n in nodes}
 
         # Populate the lists using classic for loops
         for n, port_name, port_value in self.all_ports_sub_nodes(nodes, ret_in=True):
-            own_in_port_to_ref[self._encode_node_port(n, port_name)] = (n, port_name, port_value)
-            own_in_port_reverse[f"{str(n)}.{port_name}"] = self._encode_node_port(n, port_name)
+            own_in_port_to_ref[f"{names[id(n)]}_{port_name}"] = (n, port_name, port_value)
+            own_in_port_reverse[id(n)][port_name] = f"{names[id(n)]}_{port_name}"
             
         for n, port_name, port_value in self.all_ports_sub_nodes(nodes, ret_in=False):
-            own_out_port_to_ref[self._encode_node_port(n, port_name)] = (n, port_name, port_value)
-            own_out_port_reverse[f"{str(n)}.{port_name}"] = self._encode_node_port(n, port_name)
+            own_out_port_to_ref[f"{names[id(n)]}_{port_name}"] = (n, port_name, port_value)
+            own_out_port_reverse[id(n)][port_name] = f"{names[id(n)]}_{port_name}"
+
+        return own_in_port_to_ref, own_out_port_to_ref, own_in_port_reverse, own_out_port_reverse
+
+    def _adopt(self, n, name, ports_in, ports_out):
+        # set a unique name for each node, so that it is not changed during connection into any existing graph
+        # NOTE: we set this here as we don't want the suffix to bleed into the port names etc
+        #    only for keeping the node name unique within the subgraph and the serialized graph
+        #    TODO: double check if this results in any issues down the road -> so far test are looking good -yh
+        #       -> only issue is that the node name changes between multiple graph loads -> and thus the gui cannot save the running layout properly
+        n.name = f"{n.name}{self.node_macro_id_suffix}"
+        n.__class__ = _child_class(n.__class__)
+        if membership(n) is None:
+            n._macro = MacroMembership()
+        n._macro.join(self, name, ports_in, ports_out)
+
+    # --- Reload ----------------
+    def reload(self):
+        """
+        Re-reads our file and updates the sub-graph in place: only children whose class or settings changed are replaced, all others (and their state) are kept.
+        Connections from and to the rest of the graph are kept on all ports we still expose, in the same port mapping.
+        Must not be called while the graph is running. Returns the names of the replaced, added and removed children.
+        """
+        if self._lazy:
+            # nothing to update, the current file is read once we are materialized
+            return {"replaced": [], "added": [], "removed": []}
+        if self._metrics is not None:
+            raise ValueError(f'{str(self)} is instrumented, its metrics are laid out for the current sub-graph and cannot be reloaded')
+
+        template = self._load_template(self.path, self.params)
+        in_fields, out_fields = template.ports_for(self.params)
+        pl = template.instantiate(self.params)
+        fresh = self._discover_graph_excl_macros(pl)
+        names = {id(n): self._child_name(n) for n in fresh}
+
+        # --- Diff by name and settings ----------------
+        old = {membership(n).name: n for n in self._nodes}
+        kept = {}
+        for n in fresh:
+            prev = old.get(names[id(n)])
+            if prev is not None and self._same_child(prev, n):
+                kept[id(n)] = prev
+        swap = lambda n: kept.get(id(n), n)
+        kept_ids = set(map(id, kept.values()))
+        nodes = [swap(n) for n in fresh]
+        names = {id(swap(n)): names[id(n)] for n in fresh}
+        added = [n for n in fresh if id(n) not in kept]
+        own_ids = set(map(id, nodes))
+
+        # --- Detach ----------------
+        # connections crossing our boundary are re-attached on the same field, as long as we still expose it
+        in_names, out_names = set(f for f, _ in in_fields), set(f for f, _ in out_fields)
+        reattach_in, reattach_out, others = [], [], []
+        for con in list(self._boundary_in):
+            field = membership(con._recv_node).ports_in[con._recv_port.key]
+            if id(con._recv_node) not in kept_ids or field not in in_names:
+                _remove_input(con._recv_node, con)
+                others.append((getattr(membership(con._emit_node), 'outer', None), con))
+                if field in in_names:
+                    reattach_in.append((con._emit_node, con._emit_port, field))
+        for con in list(self._boundary_out):
+            field = membership(con._emit_node).ports_out[con._emit_port.key]
+            if id(con._emit_node) not in kept_ids or field not in out_names:
+                _remove_input(con._recv_node, con)
+                others.append((getattr(membership(con._recv_node), 'outer', None), con))
+                if field in out_names:
+                    reattach_out.append((con._recv_node, con._recv_port, field))
+        # macros on the other side keep their own index of the connections
+        for m, con in others:
+            if m is not None:
+                m._unindex(con)
+
+        # connections within the sub-graph are compared by their ends, only the ones that are gone are removed
+        key = lambda con: (id(con._emit_node), con._emit_port.key, id(con._recv_node), con._recv_port.key)
+        wanted = {}
+        for n in fresh:
+            for con in n.input_connections:
+                wanted[(id(swap(con._emit_node)), con._emit_port.key, id(swap(con._recv_node)), con._recv_port.key)] = (swap(con._emit_node), con._emit_port, swap(con._recv_node), con._recv_port)
+        for n in self._nodes:
+            for con in list(n.input_connections):
+                if id(con._emit_node) in self._own_ids and (id(n) not in kept_ids or key(con) not in wanted):
+                    _remove_input(n, con)
+        for n in added:
+            # the remaining connections of the fresh instance point to the copies of kept children
+            n.input_connections, n.output_connections = [], []
+
+        # --- Attach ----------------
+        current = set(key(con) for n in nodes for con in n.input_connections)
+        for k, (emit_node, emit_port, recv_node, recv_port) in wanted.items():
+            if k not in current:
+                super(recv_node.__class__, recv_node).add_input(emit_node, emit_port, recv_port)
+
+        own_in_port_to_ref, own_out_port_to_ref, own_in_port_reverse, own_out_port_reverse = self._port_maps(nodes, names)
+        for n in nodes:
+            if id(n) in kept_ids:
+                n._macro.ports_in, n._macro.ports_out = own_in_port_reverse[id(n)], own_out_port_reverse[id(n)]
+            else:
+                n.compute_on = self._child_location(names[id(n)])
+                n.attrs.append(MAttr.macro_child)
+                self._adopt(n, names[id(n)], own_in_port_reverse[id(n)], own_out_port_reverse[id(n)])
+
+        if self.ports_in._fields != [f for f, _ in in_fields] or self.ports_out._fields != [f for f, _ in out_fields]:
+            # the class is what defines our ports, unchanged fields keep their name (and thus the serialized connections)
+            self.__class__ = Macro._get_class(self.path, self.params)
+
+        self.pl = swap(pl)
+        self._nodes = nodes
+        self._own_ids = own_ids
+        self._invalidate_compact()
+        self.own_in_port_to_ref = own_in_port_to_ref
+        self.own_out_port_to_ref = own_out_port_to_ref
+
+        for emit_node, emit_port, field in reattach_in:
+            mapped_node, _, mapped_port = own_in_port_to_ref[field]
+            super(mapped_node.__class__, mapped_node).add_input(emit_node, emit_port, mapped_port)
+            m = getattr(membership(emit_node), 'outer', None)
+            if m is not None:
+                m._boundary_out.append(mapped_node.input_connections[-1])
+        for recv_node, recv_port, field in reattach_out:
+            mapped_node, _, mapped_port = own_out_port_to_ref[field]
+            super(recv_node.__class__, recv_node).add_input(mapped_node, mapped_port, recv_port)
+            _expose(recv_node.input_connections[-1])
+            m = getattr(membership(recv_node), 'outer', None)
+            if m is not None:
+                m._boundary_in.append(recv_node.input_connections[-1])
+                m._invalidate_compact(recv_node)
+        self._boundary_in = [con for n in nodes for con in n.input_connections if id(con._emit_node) not in own_ids]
+        self._boundary_out = [con for n in nodes for con in n.output_connections if id(con._recv_node) not in own_ids]
+        for m in {id(m): m for m, _ in others if m is not None}.values():
+            m._leave_names()
+        self._leave_names()
+
+        replaced = [names[id(n)] for n in added if names[id(n)] in old]
+        return {
+            "replaced": replaced,
+            "added": [names[id(n)] for n in added if names[id(n)] not in old],
+            "removed": [name for name, n in old.items() if id(n) not in kept_ids and name not in replaced],
+        }
 
+    @staticmethod
+    def _same_child(prev, n):
+        # the name carries our suffix and compute_on is set by us, everything else has to match for the running child to be kept
+        settings = lambda node: {k: v for k, v in node._settings().items() if k != 'name'}
+        return _plain_class(prev.__class__) is _plain_class(n.__class__) and settings(prev) == settings(n)
+
+    def _compact_entry(self, node):
+        """
+        Settings and serialized inputs from outside the sub-graph of one of our children.
+        Both are cached until they are invalidated explicitly (see _invalidate_compact).
+        """
+        if self._compact_config is None:
+            self._compact_config = self._node_settings()
+        cached = self._compact_cache.get(id(node))
+        # nodes outside of macros do not tell us when they are renamed, thus we compare the names their connections were serialized with
+        if cached is None or any(emit_node.name != name for emit_node, name in cached[1]):
+            cached = self._compact_cache[id(node)] = self._serialize_inputs(node)
+        return self._compact_config, cached[0]
+
+    def _serialize_inputs(self, node):
+        inputs, names = [], []
+        for inp in self._boundary_in:
+            if inp._recv_node is not node:
+                continue
+            if membership(inp._emit_node) is None:
+                names.append((inp._emit_node, inp._emit_node.name))
+            # copy connection, so that the original is not changed (not sure if necessary, but feels right)
+            inp = Connection(inp._emit_node, inp._recv_node, inp._emit_port, inp._recv_port)
+            # change the recv_node to the macro node
+            inp._emit_node, inp._emit_port = self.adjust(inp._emit_node, inp._emit_port, in_ports=False) # emiting node -> their output port is relevant
+            inp._recv_node, inp._recv_port = self.adjust(inp._recv_node, inp._recv_port, in_ports=True) # recv node -> their input port is relevant
+            inputs.append(inp.serialize_compact())
+        return inputs, names
+
+    def _invalidate_compact(self, node=None):
+        # called whenever our settings (node=None) or the connections into one of our children change, see _compact_entry
+        cache = self.__dict__.get('_compact_cache')
+        if cache is None:
+            return
+        if node is None:
+            self._compact_config = None
+            cache.clear()
+        else:
+            cache.pop(id(node), None)
+
+    def instrument(self, window=1024):
+        """
+        Starts collecting runtime metrics of our children (see runtime.metrics.MacroMetrics), needs to be called before the graph is started.
+        """
+        if self._metrics is None:
+            self._metrics = MacroMetrics(self, window=window)
+        return self._metrics
+
+    def result_cache(self):
+        """
+        Cache of our outputs, kept across graph runs within this process (and across processes via cache_dir).
+        """
+        if self._cache is None:
+            self._cache = MacroCache(DEFAULT_MAX_BYTES if self.cache is True else self.cache, directory=self.cache_dir)
+        return self._cache
+
+    def record(self, directory):
+        """
+        Records all samples crossing our ports into directory (see runtime.record.MacroRecorder), needs to be called before the graph is started.
+        The recording can be replayed on the macro alone with runtime.replay.
+        """
+        if self._recorder is None:
+            self._recorder = MacroRecorder(self, directory)
+        return self._recorder
+
+    def place(self, costs=None, edge_bytes=None, cores=None, freeze=False):
+        """
+        Spreads our children over up to cores processes (see runtime.place), only used with compute_on="auto".
+        Costs (seconds per call) and edge_bytes (bytes emitted per call) by child name default to what was measured while instrumented.
+        Returns the report including the placement, with freeze the placement is kept in our settings and thus serialized.
+        """
+        if self.compute_on != AUTO:
+            raise ValueError(f'{str(self)} is placed on {self.compute_on}, set compute_on="{AUTO}" to place its children automatically')
+        report = plan_placement(self, costs=costs, edge_bytes=edge_bytes, cores=cores)
+        for n in self.nodes:
+            n.compute_on = report["placement"][membership(n).name]
+        if freeze:
+            self.placement = report["placement"]
+            self._invalidate_compact()
+        self.info(f'Placed children on {len(report["loads"])} process(es), estimated latency {report["latency"]:.6f}s, {report["cross_bytes"]:.0f} bytes between processes per sample')
+        return report
+
+    def run_offline(self, inputs, chunk_size=1, outputs=None, stream=False):
+        """
+        Runs our sub-graph on whole arrays (or .npy files) in the calling thread, without the livenodes runtime (see runtime.offline).
+        """
+        return run_offline(self, inputs, chunk_size=chunk_size, outputs=outputs, stream=stream)
+
+    def metrics(self):
+        """
+        Snapshot of our runtime metrics, None if we are not instrumented.
+        """
+        if self._metrics is None:
+            return None
+        return self._metrics.snapshot()
 
+    @property
+    def nodes(self):
+        self.materialize()
+        return self._nodes
+
+    def materialize(self):
+        """
+        Creates the sub-graph of a lazy macro and moves all connections made so far onto it.
+        """
+        if not self._lazy:
+            return
+        inputs, outputs = list(self.input_connections), list(self.output_connections)
+        for con in inputs:
+            self._drop(con._emit_node.output_connections, con)
+        for con in outputs:
+            self._drop(con._recv_node.input_connections, con)
+        self.input_connections, self.output_connections = [], []
+
+        self._lazy = False
+        self._build()
+
+        # connect via the outermost macro, so that serialization and name bookkeeping are the same as for eagerly created macros
+        for con in inputs:
+            emit_node, emit_port = self._outer(con._emit_node, con._emit_port, in_ports=False)
+            self.add_input(emit_node, emit_port, con._recv_port)
+        for con in outputs:
+            recv_node, recv_port = self._outer(con._recv_node, con._recv_port, in_ports=True)
+            recv_node.add_input(self, con._emit_port, recv_port)
+
+    def lock(self):
+        # a plain livenodes Graph has already discovered its nodes at this point, thus it would start us as an (empty) node instead of our sub-graph
+        if self._lazy:
+            raise ValueError(f'{str(self)} is lazy and its sub-graph was not created yet, start the graph with MacroGraph or call materialize() (or runtime.materialize_all) before creating the Graph')
+        return super().lock()
 
-        # --- Set object specifics ----------------
-        self.pl = pl
-        self.nodes = nodes
-        self.own_in_port_to_ref = own_in_port_to_ref
-        self.own_out_port_to_ref = own_out_port_to_ref
-        self.own_in_port_reverse = own_in_port_reverse
-        self.own_out_port_reverse = own_out_port_reverse
+    @staticmethod
+    def _drop(lst, con):
+        lst[:] = [c for c in lst if c is not con]
 
-        # --- Patch Settings / Serialization ----------------
-        # There are two main thoughts: (1) how to patch inputs into the macro and (2) how to patch nodes the macro inputs to (ie macros output)
-        # (1) The idea for inputs is to replace the compact_settings method of each node with a method that just returns the macro nodes settings
-        #   because the to_compact_dict method used for serialization overwrites nodes with the same str(node) (which should not occur, as each name must be unique in the graph) we can use that
-        #   to just return the settings of the macro node over and over and not worrying about duplicates in the serialized output
-        #   however, this is not the case for inputs, as they use inputs.extend() and thus we should only return those once
-        # (2) The idea for outputs is to overwrite the serialize_compact method of their connection classes to return the macro instead of the sub-graph nodes
-        #   This happens by overwriting the add_output method of the sub-graph nodes
-        closure_self = self
-        def compact_settings(self):
-            nonlocal closure_self
-            config = closure_self.get_settings().get('settings', {})
-            inputs = []
-            for inp in self.input_connections:
-                # only keep those connections that are from outside the sub-graph to inside it
-                if closure_self.node_macro_id_suffix not in str(inp._emit_node):
-                    # copy connection, so that the original is not changed (not sure if necessary, but feels right)
-                    inp = Connection(inp._emit_node, inp._recv_node, inp._emit_port, inp._recv_port)
-                    # change the recv_node to the macro node
-                    inp._emit_node, inp._emit_port = closure_self.adjust(inp._emit_node, inp._emit_port, in_ports=False) # emiting node -> their output port is relevant
-                    inp._recv_node, inp._recv_port = closure_self.adjust(inp._recv_node, inp._recv_port, in_ports=True) # recv node -> their input port is relevant
-                    inputs.append(inp.serialize_compact())
-            return config, inputs, closure_self._serialize_name()
-        
-        def get_name_resolve_macro(self):
-            name = self.name
-            for m in self._macro_parent:
-                name = name.replace(m.node_macro_id_suffix, f"({str(m)})")
-            return name
+    def __str__(self):
+        # while lazy we are part of the graph ourselves, thus connections to us have to serialize to the generic class (see _serialize_name)
+        if self._lazy:
+            return f"{self.name} [Macro]"
+        return super().__str__()
 
-        for n in nodes:
-            # set a unique name for each node, so that it is not changed during connection into any existing graph
-            # NOTE: we set this here as we don't want the suffix to bleed into the port names etc
-            #    only for keeping the node name unique within the subgraph and the serialized graph
-            #    TODO: double check if this results in any issues down the road -> so far test are looking good -yh
-            #       -> only issue is that the node name changes between multiple graph loads -> and thus the gui cannot save the running layout properly
-            n.name = f"{n.name}{self.node_macro_id_suffix}"
-            # following: https://stackoverflow.com/a/28127947
-            n.compact_settings = compact_settings.__get__(n, n.__class__)
-            n.get_name_resolve_macro = get_name_resolve_macro.__get__(n, n.__class__)
-            if not hasattr(n, '_macro_parent'):
-                n._macro_parent = []
-            n._macro_parent.append(self)
+    @property
+    def name(self):
+        return self._name
+
+    @name.setter
+    def name(self, value):
+        # keep the name registry of our graph in sync, no matter how the name is set
+        registry = self.__dict__.get('_macro_names')
+        if registry is not None:
+            value = registry.find().rename(self, self.__dict__.get('_name'), value)
+        self._name = value
+        # our name is part of our serialized settings and of the connections from and to us
+        self._invalidate_compact()
+        for con in self.__dict__.get('_boundary_out', []):
+            m = getattr(membership(con._recv_node), 'outer', None)
+            if m is not None:
+                m._invalidate_compact(con._recv_node)
 
     @staticmethod
-    def name(name, path):
+    def default_name(name, path):
         if name is not None:
             return name
         return f"Macro:{path.split('/')[-1].split('.')[-2]}"
 
+    @classmethod
+    def _load_template(cls, path, params=None):
+        template = template_cache.get(path)
+        key = template.ports_key(params)
+        if key not in template.variant_ports:
+            # the ports only depend on the file and params, so we only need to discover them once per variant
+            # for the defaults a manifest (or an up to date library index, see utils.library) saves us from instantiating the sub-graph
+            ports = None
+            if key == template.ports_key():
+                manifest = read_manifest(template)
+                if manifest is None:
+                    manifest = library_manifest(template)
+                if manifest is not None:
+                    ports = ports_from_manifest(manifest)
+                    template.from_manifest = True
+            if ports is None:
+                ports = cls._port_signature(cls._discover_graph_excl_macros(template.instantiate(params)))
+            template.variant_ports.setdefault(key, ports)
+        return template
+
+    @classmethod
+    def _port_signature(cls, nodes):
+        # Initialize lists for field names and defaults
+        in_fields, out_fields = [], []
+
+        # Populate the lists using classic for loops
+        for n, port_name, port_value in cls.all_ports_sub_nodes(nodes, ret_in=True):
+            # only keep those inputs that aren't already taken
+            # TODO: check if we could add this functionality to the port class itself, this feels kinda hacky -yh
+            # could also consider adding it to the node class itself
+            if id(port_value) not in [id(x._recv_port) for x in n.input_connections]:
+                macro_port = port_value.__class__(f"{cls._child_name(n)}: {port_value.label}", optional=port_value.optional, key=port_value.key)
+                in_fields.append((f"{cls._child_name(n)}_{port_name}", macro_port))
+            
+        for n, port_name, port_value in cls.all_ports_sub_nodes(nodes, ret_in=False):
+            macro_port = port_value.__class__(f"{cls._child_name(n)}: {port_value.label}", optional=port_value.optional, key=port_value.key)
+            out_fields.append((f"{cls._child_name(n)}_{port_name}", macro_port))
+
+        return in_fields, out_fields
+
     @staticmethod
     def all_ports_sub_nodes(nodes, ret_in = True):
         return [(n, port_name, port_value) for n in nodes for (port_name, port_value) in (n.ports_in if ret_in else n.ports_out)._asdict().items()]
@@ -125,7 +532,13 @@ class MacroHelper(Node, abstract_class=True):
         return f"[[m:{id(self)}]]"
     
     def _settings(self):
-        return {"path": self.path, "name": self.name}
+        settings = {"path": self.path, "name": self.name}
+        # the options are only serialized if set, such that graphs saved before they existed (or without using them) stay the same
+        for key, default in self._option_defaults.items():
+            value = getattr(self, key)
+            if value != default:
+                settings[key] = dict(value) if isinstance(value, dict) else value
+        return settings
     
     # def compact_settings(self):
     #     config = self.get_settings().get('settings', {})
@@ -143,6 +556,7 @@ class MacroHelper(Node, abstract_class=True):
         # set values (again, we need a more specific idea of how node states and setting changes should look like!)
         for key, val in kwargs.items():
             setattr(self, key, val)
+        self._invalidate_compact()
 
         # return the finally set values (TODO: should this be explizit? or would it be better to expect that params might not by finally set as passed?)
         return kwargs
@@ -163,17 +577,24 @@ class MacroHelper(Node, abstract_class=True):
         return mapped_node, mapped_port
     
     @staticmethod
-    def adjust(node, port, in_ports):
-        if not hasattr(node, '_macro_parent'):
+    def _outer(node, port, in_ports):
+        # maps a sub-graph node and port to the macro (and its port) that exposes them
+        record = membership(node)
+        if record is None or record.outer is None:
             return node, port
-        m_parent = node._macro_parent[-1]
-        tmp_key = f"{str(node)}.{port.key}".replace(m_parent.node_macro_id_suffix, '')
+        m_parent = record.outer
         if in_ports:
-            _port = getattr(m_parent.ports_in, m_parent.own_in_port_reverse[tmp_key])
+            _port = getattr(m_parent.ports_in, record.ports_in[port.key])
         else:
-            _port = getattr(m_parent.ports_out, m_parent.own_out_port_reverse[tmp_key])
-        _node = m_parent._serialize_name()
-        return _node, _port
+            _port = getattr(m_parent.ports_out, record.ports_out[port.key])
+        return m_parent, _port
+
+    @staticmethod
+    def adjust(node, port, in_ports):
+        if membership(node) is None:
+            return node, port
+        m_parent, _port = MacroHelper._outer(node, port, in_ports)
+        return m_parent._serialize_name(), _port
     
     def get_non_macro_node(self):
         if hasattr(self.nodes[0], 'get_non_macro_node'):
@@ -186,6 +607,12 @@ class MacroHelper(Node, abstract_class=True):
         if isinstance(node, MacroHelper) or MAttr.macro in node.attrs:
             node = node.nodes[0]
         nodes = node.discover_graph(node, direction=direction, sort=sort)
+        lazy = [n for n in nodes if getattr(n, '_lazy', False)]
+        if len(lazy) > 0:
+            # nested lazy macros are part of our sub-graph, thus they are created together with it
+            for m in lazy:
+                m.materialize()
+            return MacroHelper._discover_graph_excl_macros(node, direction=direction, sort=sort)
         return node.remove_discovered_duplicates(nodes)
     
     @staticmethod
@@ -195,39 +622,60 @@ class MacroHelper(Node, abstract_class=True):
             node = node.nodes[0]
         nodes = []
         for n in node.discover_graph(node, direction=direction, sort=sort):
-            if hasattr(n, '_macro_parent'):
-                nodes.extend(n._macro_parent)
+            if membership(n) is not None:
+                nodes.append(membership(n).outer)
+            elif isinstance(n, MacroHelper):
+                nodes.append(n)
         return node.remove_discovered_duplicates(nodes)
         
-    def is_unique_macro_name(self, name, macro_list):
-        # since macros all have the same class suffix, we only need to check for the name itself
-        for m in macro_list:
-            if m.name == name and m is not self:
-                return False
-        return True
-        # return not name in [x.name for x in  set(macro_list) - set([self])]
-    
-    def create_unique_name(self, base, macro_list):
-        if self.is_unique_macro_name(base, macro_list):
-            return base
-        return self.create_unique_name(f"{base}_1", macro_list)
-    
     def make_sure_name_is_unique(self, name):
-        macro_list = self.discover_graph_macros_only(self.get_non_macro_node())
-        if not self.is_unique_macro_name(name, macro_list):
-            new_name = self.create_unique_name(name, macro_list)
+        # our graph may have been joined with others via plain connections since we last looked
+        registry = self._join_names(MacroNameRegistry.lookup(self if self._lazy else self.nodes[0]))
+        if not registry.is_unique(name, self):
+            new_name = registry.allocate(name, self)
             self.warn(f"{str(self)} not unique in new graph. Renaming Node to: {new_name}")
             return new_name
         return name
 
+    def _join_names(self, registry):
+        # the other graph is already part of the processing graph, thus our side gets renamed on conflicts
+        return registry.merge(self._macro_names)
+
+    def _leave_names(self):
+        # once we are not connected to anything outside our sub-graph anymore, we are no longer part of that graph
+        # NOTE: disconnecting may split a graph into two, both parts then keep the shared registry, which only reserves more names than strictly necessary
+        if self._lazy:
+            if len(self.input_connections) > 0 or len(self.output_connections) > 0:
+                return
+            self._macro_names.find().remove(self, self.name)
+            self._macro_names = MacroNameRegistry()
+            self.name = self._name
+            return
+
+        if len(self._boundary_in) > 0 or len(self._boundary_out) > 0:
+            return
+        self._macro_names.find().remove(self, self.name)
+        self._macro_names = MacroNameRegistry()
+        self.name = self._name
+
     def add_input(self, emit_node, emit_port, recv_port):
+        if self._lazy:
+            registry = MacroNameRegistry.lookup(emit_node)
+            super().add_input(emit_node, emit_port, recv_port)
+            self._join_names(registry)
+            return
+
         # Retrieve the appropriate node from self.in_map using recv_port
         # TODO: the correct_node is wrong here, since its mapping is determined in __new__ however the object created in __init__ is different and unfortunately the created ports contain the subgraph's macro suffix
         mapped_node, mapped_port = self.__get_correct_node(recv_port, io='in')
+        # look up the registry before connecting, so that only the emitting graph would need to be discovered
+        registry = MacroNameRegistry.lookup(emit_node)
         # Call super().add_input() with the mapped node
         super(mapped_node.__class__, mapped_node).add_input(emit_node, emit_port, mapped_port)
+        self._boundary_in.append(mapped_node.input_connections[-1])
+        self._invalidate_compact(mapped_node)
         # after the processing graph is connected, make sure the macro name is unique as well
-        self._set_attr(name=self.make_sure_name_is_unique(self.name))
+        self._join_names(registry)
         
 
     def _serialize_name(self):
@@ -235,69 +683,95 @@ class MacroHelper(Node, abstract_class=True):
     
     @staticmethod
     def _get_node_name(node):
-        name = node.name
-        if hasattr(node, '_macro_parent'):
-            for n in node._macro_parent:
-                name = name.replace(n.node_macro_id_suffix, '')
-        return name
+        # name of one of our nodes, as used in our port names
+        record = membership(node)
+        if record is None:
+            return node.name
+        return record.name
+
+    @staticmethod
+    def _child_name(node):
+        # name of a node of a (not yet created) macro's sub-graph, nodes of nested macros are qualified by that macro's name
+        # ie a node Noop of the nested macro Inner exposes Inner_Noop_any, which does not collide with a Noop of the sub-graph itself
+        record = membership(node)
+        if record is None:
+            return node.name
+        return f"{record.outer.name}_{record.name}"
 
     def _add_output(self, connection):
-        new_obj = self
-        def map_fn(con):
-            nonlocal new_obj
-            if con._emit_node is new_obj:
-                mapped_node, mapped_port = new_obj.__get_correct_node(con._emit_port, io='out')
-                con._emit_node = mapped_node
-                con._emit_port = mapped_port
-            return con
-
-        def serialize_compact(self):
-            nonlocal new_obj
-            # the str(self._emit_node) should not change, since neither the class nor the name of the node are accessible to the user
-            # except, that the name might be changed by the system if str(node) is not unique in the graph
-            #   -> we could prefix the node name with the macro name
-            #   -> but the macro name is only truly set after the macro is created and connected to the subgraph
-            #   -> is there a better unique prefix, that we know not yet exists in a graph?
-            #   -> here the dragon bites it's own tail... =
-            #   => change the nodes name, rather than the macro's name
-            emit_port = new_obj._encode_node_port(self._emit_node, self._emit_port.key).replace(new_obj.node_macro_id_suffix, '')
-            print('seralizing con', emit_port)
-            return f"{new_obj._serialize_name()}.{emit_port} -> {str(self._recv_node)}.{str(self._recv_port.key)}"
-
-        # it is important we keep the original function here, as we might patch this multiple times 
-        # e.g. if multiple (different) macros input to the same node
-        prev_rm_fn = connection._recv_node.remove_input_by_connection
-        def remove_input_by_connection(self, connection):
-            nonlocal map_fn
-            prev_rm_fn(map_fn(connection))
-
-        # patch connection
-        connection = map_fn(connection)
-        connection.serialize_compact = serialize_compact.__get__(connection, connection.__class__)
-        # patch recv_node so that it removes the correct input if the connection is removed later
-        connection._recv_node.remove_input_by_connection = remove_input_by_connection.__get__(connection._recv_node, connection._recv_node.__class__)
+        if self._lazy:
+            recv_registry = MacroNameRegistry.lookup(connection._recv_node)
+            super()._add_output(connection)
+            self._macro_names.find().merge(recv_registry)
+            return
+
+        # the receiving graph is the one newly added to ours, look it up before it is connected to us
+        recv_registry = MacroNameRegistry.lookup(connection._recv_node)
+
+        # the connection is made from our node, its serialization and removal are mapped back to us (see _expose)
+        connection = self._map_emit(connection)
+        _expose(connection)
         # now add the connection to the mapped node
         super(connection._emit_node.__class__, connection._emit_node)._add_output(connection)
+        self._boundary_out.append(connection)
+        self._macro_names.find().merge(recv_registry)
 
     def remove_all_inputs(self):
-        # TODO: this is currently untested
-        for n in self.nodes:
-            for con in n.input_connections:
-                # only remove connections that are from outside the sub-graph to inside it
-                if self.node_macro_id_suffix not in str(con._emit_node):
-                    super(n.__class__, n).remove_input_by_connection(con)
-    
+        if self._lazy:
+            for con in list(self.input_connections):
+                super().remove_input_by_connection(con)
+            self._leave_names()
+            return
+
+        # only remove connections that are from outside the sub-graph to inside it
+        for con in list(self._boundary_in):
+            super(con._recv_node.__class__, con._recv_node).remove_input_by_connection(con)
+            self._unindex(con)
+            self._unindex_emitter(con)
+        self._leave_names()
+
     def remove_input_by_connection(self, connection):
-        if isinstance(connection._emit_node, MacroHelper):
+        emit_macro = None
+        if isinstance(connection._emit_node, MacroHelper) and not connection._emit_node._lazy:
+            emit_macro = connection._emit_node
             connection._emit_node, connection._emit_port = connection._emit_node.__get_correct_node(connection._emit_port, io='out')
-        mapped_node, mapped_port = self.__get_correct_node(connection._recv_port, io='in')
-        connection._recv_node = mapped_node
-        connection._recv_port = mapped_port
-        super(mapped_node.__class__, mapped_node).remove_input_by_connection(connection)
+        if self._lazy:
+            super().remove_input_by_connection(connection)
+        else:
+            mapped_node, mapped_port = self.__get_correct_node(connection._recv_port, io='in')
+            connection._recv_node = mapped_node
+            connection._recv_port = mapped_port
+            super(mapped_node.__class__, mapped_node).remove_input_by_connection(connection)
+            self._unindex(connection)
+        # we call the removal of the node's class above, thus the emitting macro(s) are not notified otherwise
+        self._unindex_emitter(connection)
+        self._leave_names()
+        if emit_macro is not None:
+            emit_macro._leave_names()
+
+    def _map_emit(self, connection):
+        # connections given with us as emitting node actually come from one of our nodes
+        if connection._emit_node is self:
+            connection._emit_node, connection._emit_port = self.__get_correct_node(connection._emit_port, io='out')
+        return connection
+
+    def _unindex(self, connection):
+        self._invalidate_compact(connection._recv_node)
+        self._boundary_in = [con for con in self._boundary_in if not con == connection]
+        self._boundary_out = [con for con in self._boundary_out if not con == connection]
+
+    @staticmethod
+    def _unindex_emitter(connection):
+        # only the outermost macro is connected to anything outside the sub-graph
+        m = getattr(membership(connection._emit_node), 'outer', None)
+        if m is not None:
+            m._unindex(connection)
 
 
     # --- mapping functions ---
     def to_compact_dict(self, graph=False):
+        if self._lazy:
+            return super().to_compact_dict(graph=graph)
         return self.get_non_macro_node().to_compact_dict(graph=graph)
     
     def dot_graph_full(self, filename=None, file_type='png', **kwargs):
@@ -305,49 +779,159 @@ class MacroHelper(Node, abstract_class=True):
 
 
 class Macro(MacroHelper):
+    # generated classes, interned per (path, port signature), so that instances of the same file share their class and port collections
+    _classes = {}
+
     def __new__(cls, path=f"{file_path}/noop.yml", name=None, compute_on="", **kwargs):
         # The only function of all this hassle is to create a new class with the correct ports
+        new_cls = cls._get_class(path, kwargs.get('params'))
         
-        # --- Load the pipeline ----------------
-        # this is not kept (ie the one kept is the one from __init__), but we need to load the pipeline to get the ports
-        pl = Node.load(path)
-        nodes = cls._discover_graph_excl_macros(pl)
-        
-        # --- Match Ports ----------------
-        # Initialize lists for field names and defaults
-        in_field_names, in_field_defaults = [], []
-        out_field_names, out_field_defaults = [], []
+        # -- Create new instance from that new class ----------------
+        new_obj = new_cls(path=path, name=name, compute_on=compute_on, **kwargs)
+        assert issubclass(new_cls, MacroHelper)
+        assert isinstance(new_obj, MacroHelper)
+        return new_obj
 
-        # Populate the lists using classic for loops
-        for n, port_name, port_value in cls.all_ports_sub_nodes(nodes, ret_in=True):
-            # only keep those inputs that aren't already taken
-            # TODO: check if we could add this functionality to the port class itself, this feels kinda hacky -yh
-            # could also consider adding it to the node class itself
-            if id(port_value) not in [id(x._recv_port) for x in n.input_connections]:
-                macro_port = port_value.__class__(f"{cls._get_node_name(n)}: {port_value.label}", optional=port_value.optional, key=port_value.key)
-                in_field_names.append(cls._encode_node_port(n, port_name))
-                in_field_defaults.append(macro_port)
-            
-        for n, port_name, port_value in cls.all_ports_sub_nodes(nodes, ret_in=False):
-            macro_port = port_value.__class__(f"{cls._get_node_name(n)}: {port_value.label}", optional=port_value.optional, key=port_value.key)
-            out_field_names.append(cls._encode_node_port(n, port_name))
-            out_field_defaults.append(macro_port)
+    @staticmethod
+    def _signature_key(fields):
+        return tuple((field_name, port.__class__, port.label, port.optional) for field_name, port in fields)
+
+    @classmethod
+    def _get_class(cls, path, params=None):
+        # --- Match Ports ----------------
+        # the template is shared with __init__ and all other instances of this file, so the pipeline is not loaded again just to get the ports
+        in_fields, out_fields = cls._load_template(path, params).ports_for(params)
 
+        key = (template_cache.resolve(path), cls._signature_key(in_fields), cls._signature_key(out_fields))
+        if key in cls._classes:
+            return cls._classes[key]
 
         # --- Create new (sub) class ----------------
         # new_cls = super(Macro, cls).__new__(cls)
         cls_name = f"Macro:{path.split('/')[-1].split('.')[-2]}"
-        new_cls = type(cls_name, (MacroHelper, ), {})
-        new_cls.example_init["path"] = path
-        new_cls.example_init["name"] = new_cls.name(name, path)
-        new_cls.ports_in = type('Macro_Ports_In', (Ports_collection,), dict(zip(in_field_names, in_field_defaults)))()
-        new_cls.ports_out = type('Macro_Ports_Out', (Ports_collection,), dict(zip(out_field_names, out_field_defaults)))()
-        
-        # -- Create new instance from that new class ----------------
-        new_obj = new_cls(path=path, name=name, compute_on=compute_on, **kwargs)
-        assert issubclass(new_cls, MacroHelper)
-        assert isinstance(new_obj, MacroHelper)
-        return new_obj
+        new_cls = type(cls_name, (MacroHelper, ), {
+            # each class gets its own example_init, as otherwise all of them would share (and overwrite) the one from MacroHelper
+            "example_init": {"path": path, "name": MacroHelper.default_name(None, path)},
+            "ports_in": type('Macro_Ports_In', (Ports_collection,), dict(in_fields))(),
+            "ports_out": type('Macro_Ports_Out', (Ports_collection,), dict(out_fields))(),
+        })
+        # setdefault, so that concurrently created classes still resolve to a single one
+        return cls._classes.setdefault(key, new_cls)
+
+# --- Children and their connections ----------------
+# Nodes of a macro's sub-graph are serialized and disconnected in terms of the macro.
+# Nothing in livenodes itself is patched: children get a subclass of their own class (see _child_class), connections leaving a macro are MacroConnections,
+# and only the nodes those connections go to get their remove_input_by_connection replaced (see _expose), as they are the ones asked to remove a connection given with the macro as emitting node.
+# All of these dispatch on the membership record, ie they are plain functions of the node and pickle by reference.
+
+class MacroChild():
+    """
+    Mixin of the classes of macro children. Generated classes keep the name of the class they are created from, ie the node still is (and shows as) what it was.
+    """
+
+    def compact_settings(self):
+        macro = getattr(membership(self), 'outer', None)
+        if macro is None:
+            return super().compact_settings()
+        config, inputs = macro._compact_entry(self)
+        # copies, so that changes to the serialized dict do not end up in our cache
+        return dict(config), list(inputs), macro._serialize_name()
+
+    def get_name_resolve_macro(self):
+        record = membership(self)
+        if record is None or record.outer is None:
+            return self.name
+        return f"{record.name}({str(record.outer)})"
+
+    @property
+    def _call_user_fn_process(self):
+        # livenodes sets the process call (including its own timing) per instance, the runtime extensions of our macro wrap it here
+        # innermost first: metrics, recording and read-only fan-out (see runtime.metrics, runtime.record, runtime.fanout)
+        # they are looked up on every call, such that none of them is kept on the node
+        call = self.__dict__.get('_call_user_fn_process', self._call_user_fn)
+        macro = getattr(membership(self), 'outer', None)
+        for ext in (getattr(macro, '_metrics', None), getattr(macro, '_recorder', None)):
+            if ext is not None:
+                call = partial(ext._call, self, call)
+        if self.__dict__.get('_shared_ports'):
+            call = partial(share_call, self, call)
+        return call
+
+    @_call_user_fn_process.setter
+    def _call_user_fn_process(self, value):
+        self.__dict__['_call_user_fn_process'] = value
+
+    def __reduce_ex__(self, protocol):
+        # the generated class cannot be looked up by name, thus we are pickled as the original class and get the generated one back on unpickling
+        reduced = super().__reduce_ex__(protocol)
+        if reduced[0] is copyreg.__newobj__:
+            return (_new_child, (self._plain_class, *reduced[1][1:]), *reduced[2:])
+        return reduced
+
+_child_classes = {}
+
+def _child_class(cls):
+    if issubclass(cls, MacroChild):
+        return cls
+    if cls not in _child_classes:
+        new_cls = type(cls.__name__, (MacroChild, cls), {
+            "__module__": cls.__module__,
+            "__qualname__": cls.__qualname__,
+            "_plain_class": cls,
+        }, abstract_class=getattr(cls, 'abstract_class', False))
+        # setdefault, so that concurrently created classes still resolve to a single one
+        _child_classes.setdefault(cls, new_cls)
+    return _child_classes[cls]
+
+def _plain_class(cls):
+    return getattr(cls, '_plain_class', cls)
+
+def _new_child(cls, *args):
+    child_cls = _child_class(cls)
+    return child_cls.__new__(child_cls, *args)
+
+
+class MacroConnection(Connection):
+    """
+    Connection from a macro's child to a node outside of the macro, serialized with the (outermost) macro as emitting node.
+    """
+
+    def serialize_compact(self):
+        # the str(self._emit_node) should not change, since neither the class nor the name of the node are accessible to the user
+        # except, that the name might be changed by the system if str(node) is not unique in the graph
+        #   -> we could prefix the node name with the macro name
+        #   -> but the macro name is only truly set after the macro is created and connected to the subgraph
+        #   -> is there a better unique prefix, that we know not yet exists in a graph?
+        #   -> here the dragon bites it's own tail... =
+        #   => change the nodes name, rather than the macro's name
+        if getattr(membership(self._emit_node), 'outer', None) is None:
+            return super().serialize_compact()
+        macro, port = MacroHelper._outer(self._emit_node, self._emit_port, in_ports=False)
+        return f"{macro._serialize_name()}.{port.key} -> {str(self._recv_node)}.{str(self._recv_port.key)}"
+
+
+def _expose(connection):
+    connection.__class__ = MacroConnection
+    recv_node = connection._recv_node
+    # macros map the connections given to them themselves
+    if not isinstance(recv_node, MacroHelper) and 'remove_input_by_connection' not in vars(recv_node):
+        recv_node.remove_input_by_connection = partial(_remove_input_by_connection, recv_node)
+
+def _remove_input(node, connection):
+    # the implementation of the node's class, ie without the replacement of _expose
+    return type(node).remove_input_by_connection(node, connection)
+
+def _remove_input_by_connection(node, connection):
+    # connections may be given with the macro as emitting node, while the actual connection is from one of its nodes
+    emit_macro = connection._emit_node if isinstance(connection._emit_node, MacroHelper) and not connection._emit_node._lazy else None
+    if emit_macro is not None:
+        connection = emit_macro._map_emit(connection)
+    _remove_input(node, connection)
+    m = getattr(membership(connection._emit_node), 'outer', None)
+    if m is not None:
+        m._unindex(connection)
+        m._leave_names()
+
 
 if __name__ == '__main__':
     m = Macro(path=Macro.example_init["path"]) 
@@ -1,6 +1,8 @@
 from livenodes.node import Node
 from ln_ports import Ports_any
 
+from .utils.readonly import readonly
+
 class Noop(Node):
     ports_in = Ports_any()
     ports_out = Ports_any()
@@ -8,6 +10,10 @@ class Noop(Node):
     category = "Data Source"
     description = ""
 
+    # only forwards its input, thus it is removed from the processing graph on compilation (see runtime.MacroGraph)
+    # if it is not, the input is forwarded as read-only view, such that all consumers share it (see utils.readonly)
+    passthrough = True
+
     example_init = {
         "name": "Noop",
     }
@@ -16,4 +22,4 @@ class Noop(Node):
         super().__init__(name, **kwargs)
 
     def process(self, any, **kwargs):
-        return self.ret(any=any)
+        return self.ret(any=readonly(any))
@@ -0,0 +1,22 @@
+from livenodes import get_registry
+
+from .compile import GraphCompilation, compile_graph, PASSES
+from .passthrough import elide_passthrough
+from .prune import prune_dead_outputs, has_side_effects
+from .fanout import share_fanout
+from .fuse import Fused, fuse_chains
+from .graph import MacroGraph, materialize_all
+from .shm_bridge import Bridge_shm, isolated_location
+from .replicate import Distributor, Merger, replicate_macros, replica_location
+from .batch import Batcher, Unbatcher, batch_macros
+from .cache import MacroCache, CacheLookup, CacheStore, cache_macros
+from .metrics import MacroMetrics, MetricsReporter
+from .place import AUTO, partition, plan_placement, place_macros
+from .offline import OfflinePlan, run_offline
+from .record import MacroRecorder, Recording, Replayer, ReplayCollector, replay
+
+# order matters: unused children are pruned first, so that no other pass has to deal with them, automatically placed macros get their locations before anything depends on them, caching wraps the macro boundary outermost (so that only misses are batched), batching wraps the macro boundary (and thus all replicas), replicas are copied from the template next (and are instrumented and recorded together with the originals, see MacroChild), then pass-through nodes are removed before shared outputs are determined, so that the remaining chains can be fused
+PASSES.extend([prune_dead_outputs, place_macros, cache_macros, batch_macros, replicate_macros, elide_passthrough, share_fanout, fuse_chains])
+
+# same as livenodes does for its own bridges, the bridge only claims connections into/out of isolated macros
+get_registry().bridges.register('Bridge_shm', Bridge_shm)
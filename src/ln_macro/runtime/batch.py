@@ -0,0 +1,172 @@
+import time
+import numpy as np
+from livenodes import Node
+from ln_ports import Port_Any
+
+from .replicate import _ports
+from ..utils.membership import macro_parents
+
+
+class Batcher(Node, abstract_class=True):
+    """
+    Accumulates samples and emits them as a single array once size samples are collected or the oldest one waited latency seconds.
+    Arrays are concatenated along their first (batch) axis, scalars are stacked. A batch only contains samples with the same inputs, ie a sample missing an optional input starts a new one.
+    The spans port tells the Unbatchers which ctrs (and how many rows of each) a batch contains.
+    """
+    category = "Meta"
+    description = ""
+
+    def __init__(self, size, latency=None, name="Batcher", **kwargs):
+        super().__init__(name, **kwargs)
+        self.size = size
+        self.latency = latency
+        self._pending = []
+        self._since = None
+        self._timer = None
+
+    @classmethod
+    def create(cls, ports, size, latency=None, **kwargs):
+        new_cls = type("Batcher", (cls, ), {
+            "ports_in": _ports('Batcher_Ports_In', ports),
+            "ports_out": _ports('Batcher_Ports_Out', ports + [("spans", Port_Any("Spans"))]),
+        })
+        return new_cls(size, latency=latency, **kwargs)
+
+    def _batch(self):
+        pending, self._pending, self._since = self._pending, [], None
+        self._cancel()
+        first = pending[0][1]
+        # rows per sample (of the first input), None if the samples were stacked (ie each one is a single row)
+        ref = next(iter(first))
+        lengths = [len(data[ref]) if np.ndim(data[ref]) > 0 else None for _, data in pending]
+        res = {}
+        for key in first:
+            values = [np.asarray(data[key]) for _, data in pending]
+            res[key] = np.concatenate(values, axis=0) if values[0].ndim > 0 else np.stack(values)
+        res['spans'] = [(ctr, n) for (ctr, _), n in zip(pending, lengths)]
+        return res
+
+    def _emit_batch(self):
+        # outside of process, thus we emit ourselves with the last ctr of the batch
+        ctr = self._pending[-1][0]
+        for key, val in self._batch().items():
+            self._emit_data(val, channel=key, ctr=ctr)
+
+    # --- latency budget ----------------
+    def _schedule(self):
+        # the budget is enforced by a timer on our event loop, so that a stalled input cannot hold back a partial batch
+        loop = getattr(self, '_loop', None)
+        if self.latency is not None and self._timer is None and loop is not None:
+            self._timer = loop.call_later(self.latency, self._on_timeout)
+
+    def _cancel(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _on_timeout(self):
+        self._timer = None
+        if len(self._pending) > 0:
+            self._emit_batch()
+
+    def process(self, _ctr, **kwargs):
+        if len(self._pending) > 0 and self._pending[0][1].keys() != kwargs.keys():
+            # values of optional inputs that are only given for some samples cannot be stacked
+            self._emit_batch()
+        self._pending.append((_ctr, kwargs))
+        if self._since is None:
+            self._since = time.time()
+            self._schedule()
+        if len(self._pending) >= self.size \
+            or (self.latency is not None and time.time() - self._since >= self.latency):
+            return self.ret(**self._batch())
+        return None
+
+    def _onbeforestop(self):
+        self._cancel()
+
+    def _onbeforefinish(self):
+        if len(self._pending) > 0:
+            self._emit_batch()
+
+
+class Unbatcher(Node, abstract_class=True):
+    """
+    Splits the result of a batch back into one output per original sample (and ctr).
+    If the result has a different number of rows than the batch, it is passed on as a whole with the last ctr.
+    """
+    category = "Meta"
+    description = ""
+
+    @classmethod
+    def create(cls, port, **kwargs):
+        new_cls = type("Unbatcher", (cls, ), {
+            "ports_in": _ports('Unbatcher_Ports_In', [("data", port), ("spans", Port_Any("Spans"))]),
+            "ports_out": _ports('Unbatcher_Ports_Out', [("out", port)]),
+        })
+        return new_cls("Unbatcher", **kwargs)
+
+    @staticmethod
+    def _split(data, spans):
+        # returns the parts per sample, None if data cannot be mapped to the samples
+        n_rows = [1 if n is None else n for _, n in spans]
+        if np.ndim(data) == 0 or len(data) not in (sum(n_rows), len(spans)):
+            return None
+        if len(data) == len(spans) and any(n is None for _, n in spans):
+            return [data[i] for i in range(len(spans))]
+        if len(data) == len(spans):
+            return [data[i:i + 1] for i in range(len(spans))]
+        return np.split(data, np.cumsum(n_rows)[:-1])
+
+    def process(self, data, spans, _ctr=None, **kwargs):
+        parts = self._split(data, spans)
+        if parts is None:
+            self.warn(f'Could not split batch of {len(spans)} samples, passing it on as a whole')
+            return self.ret(out=data)
+        for (ctr, _), part in zip(spans[:-1], parts[:-1]):
+            self._emit_data(part, channel='out', ctr=ctr)
+        return self.ret(out=parts[-1])
+
+
+def _batch(compilation, macro):
+    own = set(map(id, macro.nodes))
+    inputs = [con for n in macro.nodes for con in n.input_connections if id(con._emit_node) not in own]
+    outputs = {}
+    for n in macro.nodes:
+        for con in n.output_connections:
+            if id(con._recv_node) not in own:
+                outputs.setdefault((id(n), con._emit_port.key), []).append(con)
+    if len(inputs) == 0 or len(outputs) == 0:
+        return False
+
+    ports = [(f"in{j}", con._recv_port) for j, con in enumerate(inputs)]
+    batcher = Batcher.create(ports, macro.batch, latency=macro.batch_latency, compute_on=macro.location)
+    batcher.name = f"{macro.name}-batcher"
+    compilation.add_node(batcher)
+    for j, con in enumerate(inputs):
+        compilation.rewire(con, recv_node=batcher, recv_port=getattr(batcher.ports_in, f"in{j}"))
+        compilation.connect(batcher, getattr(batcher.ports_out, f"in{j}"), con._recv_node, con._recv_port)
+
+    for cons in outputs.values():
+        emit_node, emit_port = cons[0]._emit_node, cons[0]._emit_port
+        unbatcher = Unbatcher.create(emit_port, compute_on=macro.location)
+        unbatcher.name = f"{macro.name}-unbatcher-{emit_node.name}-{emit_port.key}"
+        compilation.add_node(unbatcher)
+        compilation.connect(emit_node, emit_port, unbatcher, unbatcher.ports_in.data)
+        compilation.connect(batcher, batcher.ports_out.spans, unbatcher, unbatcher.ports_in.spans)
+        for con in cons:
+            compilation.rewire(con, emit_node=unbatcher, emit_port=unbatcher.ports_out.out)
+    return True
+
+def batch_macros(compilation):
+    macros = {}
+    for n in compilation.nodes:
+        for m in macro_parents(n):
+            if getattr(m, 'batch', 1) > 1:
+                macros[id(m)] = m
+
+    batched = False
+    for m in macros.values():
+        m.info(f'Batching up to {m.batch} samples')
+        batched = _batch(compilation, m) or batched
+    return batched
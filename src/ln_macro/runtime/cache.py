@@ -0,0 +1,293 @@
+import os
+import sys
+import json
+import pickle
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from livenodes import Node
+from ln_ports import Port_Any
+
+from .replicate import _ports
+from ..utils.membership import membership, macro_parents
+from ..utils.library import _dependencies
+
+# used for cache=True
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+def fingerprint(values, prefix=''):
+    """
+    Hash of a list of payloads, arrays are hashed on their buffer directly (ie without pickling or copying them if they are contiguous).
+    """
+    h = hashlib.blake2b(prefix.encode('utf-8'), digest_size=16)
+    for value in values:
+        if isinstance(value, np.ndarray) and not value.dtype.hasobject:
+            h.update(f"{value.dtype.str}{value.shape}".encode('utf-8'))
+            h.update(np.ascontiguousarray(value).data)
+        else:
+            h.update(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+    return h.hexdigest()
+
+def _nbytes(value):
+    nbytes = getattr(value, 'nbytes', None)
+    return nbytes if nbytes is not None else sys.getsizeof(value)
+
+
+class MacroCache():
+    """
+    Outputs of a macro per fingerprint of its inputs, bounded to max_bytes in memory by evicting the least recently used entries.
+    With a directory, evicted entries are written there instead of dropped and read back on demand, which also keeps them across runs and processes.
+    The entries still in memory are written there on flush() (ie when the graph stops, see CacheStore).
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        # keys changed since they were last written to the directory
+        self._dirty = set()
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, key, fields):
+        """
+        Entry of key if it holds all fields, None otherwise.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and all(f in entry for f in fields):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        entry = self._read(key)
+        with self._lock:
+            if entry is not None and all(f in entry for f in fields):
+                self._insert(key, entry)
+                self.hits += 1
+                return entry
+            self.misses += 1
+            return None
+
+    def put(self, key, field, value):
+        with self._lock:
+            entry = self._entries.pop(key, None) or {}
+            self._bytes -= self._sizes.pop(key, 0)
+            entry[field] = value
+            self._insert(key, entry)
+            self._dirty.add(key)
+
+    def _insert(self, key, entry):
+        self._entries[key] = entry
+        self._sizes[key] = sum(map(_nbytes, entry.values()))
+        self._bytes += self._sizes[key]
+        # the newest entry is always kept, even if it alone exceeds the budget
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            old_key, old_entry = self._entries.popitem(last=False)
+            self._bytes -= self._sizes.pop(old_key)
+            if old_key in self._dirty:
+                self._write(old_key, old_entry)
+
+    # --- disk ----------------
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def _write(self, key, entry):
+        self._dirty.discard(key)
+        if self.directory is None:
+            return
+        # write to a temporary file first, so that concurrent readers never see a partial entry
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(key))
+
+    def _read(self, key):
+        if self.directory is None:
+            return None
+        try:
+            with open(self._path(key), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            return None
+
+    def flush(self):
+        """
+        Writes the entries that are only in memory to the directory, if there is one.
+        """
+        with self._lock:
+            if self.directory is None:
+                return
+            for key in list(self._dirty):
+                self._write(key, self._entries[key])
+
+    def clear(self):
+        with self._lock:
+            self._entries = OrderedDict()
+            self._sizes = {}
+            self._bytes = 0
+            self._dirty = set()
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries), "bytes": self._bytes}
+
+
+class CacheLookup(Node, abstract_class=True):
+    """
+    Looks up the outputs of a macro for the inputs of each ctr.
+    On a hit the cached outputs are sent to the CacheStores directly and the sub-graph never sees the sample, on a miss the inputs are passed on to the sub-graph.
+    Either way each CacheStore gets (key, hit, value) on its ctl port, so that it can keep the original order.
+    """
+    category = "Meta"
+    description = ""
+
+    def __init__(self, cache, prefix, fields, name="CacheLookup", **kwargs):
+        super().__init__(name, **kwargs)
+        self.cache = cache
+        self.prefix = prefix
+        self.fields = fields
+
+    @classmethod
+    def create(cls, ports, cache, prefix, fields, **kwargs):
+        new_cls = type("CacheLookup", (cls, ), {
+            "ports_in": _ports('CacheLookup_Ports_In', ports),
+            "ports_out": _ports('CacheLookup_Ports_Out', ports + [(f"ctl{i}", Port_Any("Cache")) for i in range(len(fields))]),
+        })
+        return new_cls(cache, prefix, fields, **kwargs)
+
+    def process(self, _ctr, **kwargs):
+        key = fingerprint([kwargs.get(key) for key in self.ports_in._fields], prefix=self.prefix)
+        entry = self.cache.get(key, self.fields)
+        if entry is not None:
+            return self.ret(**{f"ctl{i}": (key, True, entry[field]) for i, field in enumerate(self.fields)})
+        return self.ret(**kwargs, **{f"ctl{i}": (key, False, None) for i in range(len(self.fields))})
+
+
+class CacheStore(Node, abstract_class=True):
+    """
+    Passes on the output of one port of the sub-graph (on a miss, storing it in the cache) or the cached value (on a hit) in the order of the ctrs.
+    """
+    category = "Meta"
+    description = ""
+
+    def __init__(self, cache, field, name="CacheStore", **kwargs):
+        super().__init__(name, **kwargs)
+        self.cache = cache
+        self.field = field
+        self._order = []
+        self._data = {}
+
+    @classmethod
+    def create(cls, port, cache, field, **kwargs):
+        new_cls = type("CacheStore", (cls, ), {
+            "ports_in": _ports('CacheStore_Ports_In', [("data", port), ("ctl", Port_Any("Cache"))]),
+            "ports_out": _ports('CacheStore_Ports_Out', [("out", port)]),
+        })
+        return new_cls(cache, field, **kwargs)
+
+    def _should_process(self, **kwargs):
+        return len(kwargs) > 0
+
+    def _process(self, ctr):
+        # hits arrive before earlier misses are computed, thus ctrs arrive out of order and we cannot use the (asserting) default
+        data = self.data_storage.get(ctr=ctr)
+        if 'ctl' in data:
+            self._order.append((ctr, *data['ctl']))
+        if 'data' in data:
+            self._data[ctr] = data['data']
+        self.data_storage.discard_before(ctr)
+        self._flush()
+
+    def _flush(self, final=False):
+        while len(self._order) > 0:
+            ctr, key, hit, value = self._order[0]
+            if not hit:
+                if ctr in self._data:
+                    value = self._data.pop(ctr)
+                    self.cache.put(key, self.field, value)
+                elif final or any(c > ctr for c in self._data):
+                    # the sub-graph processes in order, if it already sent later ctrs it did not emit anything for this one
+                    self._order.pop(0)
+                    continue
+                else:
+                    return
+            self._order.pop(0)
+            self._ctr = ctr
+            self._emit_data(value, channel='out', ctr=ctr)
+
+    def _onbeforefinish(self):
+        self._flush(final=True)
+
+    def _onfinish(self):
+        # the last outputs were stored in _onbeforefinish, which also runs if we were stopped
+        self.cache.flush()
+
+
+def _cache_prefix(macro):
+    # the same inputs only give the same outputs for the same files (ours and all nested ones) and params
+    template = macro._load_template(macro.path, macro.params)
+    nested = sorted(_dependencies(template).values())
+    return f"{template.content_hash}{''.join(nested)}{json.dumps(macro.params, sort_keys=True, default=str)}"
+
+def _cache(compilation, macro):
+    own = set(map(id, macro.nodes))
+    inputs = [con for n in macro.nodes for con in n.input_connections if id(con._emit_node) not in own]
+    outputs = {}
+    for n in macro.nodes:
+        for con in n.output_connections:
+            if id(con._recv_node) not in own:
+                outputs.setdefault((id(n), con._emit_port.key), []).append(con)
+    if len(inputs) == 0 or len(outputs) == 0:
+        return False
+
+    prefix = _cache_prefix(macro)
+    cache = macro.result_cache()
+    # the cache is kept in our process, thus lookups and stores run here as well, no matter where the sub-graph runs
+    location = ""
+    fields = [membership(cons[0]._emit_node).ports_out[cons[0]._emit_port.key] for cons in outputs.values()]
+
+    ports = [(f"in{j}", con._recv_port) for j, con in enumerate(inputs)]
+    lookup = CacheLookup.create(ports, cache, prefix, fields, compute_on=location)
+    lookup.name = f"{macro.name}-cache-lookup"
+    compilation.add_node(lookup)
+    for j, con in enumerate(inputs):
+        compilation.rewire(con, recv_node=lookup, recv_port=getattr(lookup.ports_in, f"in{j}"))
+        compilation.connect(lookup, getattr(lookup.ports_out, f"in{j}"), con._recv_node, con._recv_port)
+
+    for i, (field, cons) in enumerate(zip(fields, outputs.values())):
+        emit_node, emit_port = cons[0]._emit_node, cons[0]._emit_port
+        store = CacheStore.create(emit_port, cache, field, compute_on=location)
+        store.name = f"{macro.name}-cache-store-{field}"
+        compilation.add_node(store)
+        compilation.connect(emit_node, emit_port, store, store.ports_in.data)
+        compilation.connect(lookup, getattr(lookup.ports_out, f"ctl{i}"), store, store.ports_in.ctl)
+        for con in cons:
+            compilation.rewire(con, emit_node=store, emit_port=store.ports_out.out)
+    return True
+
+def cache_macros(compilation):
+    """
+    Skips the sub-graph of macros with cache set for inputs they already processed.
+    Only meant for deterministic macros: children with side effects are skipped on a hit as well.
+    """
+    macros = {}
+    for n in compilation.nodes:
+        for m in macro_parents(n):
+            if getattr(m, 'cache', False):
+                macros[id(m)] = m
+
+    cached = False
+    for m in macros.values():
+        m.info('Caching results')
+        cached = _cache(compilation, m) or cached
+    return cached
@@ -0,0 +1,114 @@
+from livenodes import Connection
+
+import logging
+logger = logging.getLogger('livenodes')
+
+
+class GraphCompilation():
+    """
+    Reversible rewrite of a processing graph before it is started.
+    Passes only replace connections and nodes here, so that the original topology (and thus serialization) can be restored afterwards.
+    """
+
+    def __init__(self, nodes):
+        self.nodes = list(nodes)
+        self._original = set(map(id, self.nodes))
+        self._saved = {}
+        # undo steps of passes that keep state on the nodes themselves, see release()
+        self._releases = []
+        self.applied = []
+
+    def _save(self, node):
+        # keep the original connection lists once per node, restoring those is simpler and more robust than undoing every single step
+        # nodes added by passes keep their connections, as they may still be running when the original topology is restored
+        if id(node) in self._original and id(node) not in self._saved:
+            self._saved[id(node)] = (node, list(node.input_connections), list(node.output_connections))
+
+    @staticmethod
+    def _replace(lst, old, new):
+        for i, con in enumerate(lst):
+            if con is old:
+                if new is None:
+                    del lst[i]
+                else:
+                    lst[i] = new
+                return
+        if new is not None:
+            lst.append(new)
+
+    def rewire(self, con, emit_node=None, emit_port=None, recv_node=None, recv_port=None):
+        new_con = Connection(emit_node if emit_node is not None else con._emit_node,
+                             recv_node if recv_node is not None else con._recv_node,
+                             emit_port=emit_port if emit_port is not None else con._emit_port,
+                             recv_port=recv_port if recv_port is not None else con._recv_port)
+        for n in (con._emit_node, con._recv_node, new_con._emit_node, new_con._recv_node):
+            self._save(n)
+
+        # replace in place where possible, so that the order of connections stays the same
+        if new_con._emit_node is con._emit_node:
+            self._replace(con._emit_node.output_connections, con, new_con)
+        else:
+            self._replace(con._emit_node.output_connections, con, None)
+            self._replace(new_con._emit_node.output_connections, None, new_con)
+
+        if new_con._recv_node is con._recv_node:
+            self._replace(con._recv_node.input_connections, con, new_con)
+        else:
+            self._replace(con._recv_node.input_connections, con, None)
+            self._replace(new_con._recv_node.input_connections, None, new_con)
+        return new_con
+
+    def connect(self, emit_node, emit_port, recv_node, recv_port):
+        con = Connection(emit_node, recv_node, emit_port=emit_port, recv_port=recv_port)
+        self._save(emit_node)
+        self._save(recv_node)
+        emit_node.output_connections.append(con)
+        recv_node.input_connections.append(con)
+        return con
+
+    def disconnect(self, con):
+        self._save(con._emit_node)
+        self._save(con._recv_node)
+        self._replace(con._emit_node.output_connections, con, None)
+        self._replace(con._recv_node.input_connections, con, None)
+
+    def remove_nodes(self, nodes):
+        ids = set(map(id, nodes))
+        self.nodes = [n for n in self.nodes if id(n) not in ids]
+
+    def add_node(self, node):
+        self.nodes.append(node)
+
+    def on_release(self, fn):
+        self._releases.append(fn)
+
+    def release(self):
+        """
+        Removes the state passes kept on the nodes, such that they run as before when used without this compilation.
+        """
+        for fn in reversed(self._releases):
+            fn()
+        self._releases = []
+
+    def restore(self, release=True):
+        # nodes that are still running need the state of the passes, in that case release() is called once they are stopped (see MacroGraph)
+        for node, inputs, outputs in self._saved.values():
+            node.input_connections[:] = inputs
+            node.output_connections[:] = outputs
+        self._saved = {}
+        if release:
+            self.release()
+
+
+# passes are run in order on every compilation, each gets the compilation and rewrites it in place (see runtime/__init__.py for the defaults)
+PASSES = []
+
+def compile_graph(nodes, passes=None, disable=()):
+    compilation = GraphCompilation(nodes)
+    for fn in (PASSES if passes is None else passes):
+        if fn.__name__ in disable:
+            continue
+        if fn(compilation):
+            compilation.applied.append(fn.__name__)
+    logger.info(f'Compiled graph with {len(compilation.nodes)} nodes (applied: {compilation.applied})')
+    return compilation
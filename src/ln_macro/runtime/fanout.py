@@ -0,0 +1,37 @@
+from functools import partial
+
+from ..utils.membership import membership
+from ..utils.readonly import readonly
+
+
+def share_call(node, fn, _fn, _fn_name, *args, **kwargs):
+    # wraps the process calls of children with shared ports (see MacroChild)
+    res = fn(_fn, _fn_name, *args, **kwargs)
+    if res is None or len(node._shared_ports) == 0:
+        return res
+    emitted, ctr = res if type(res) == tuple else (res, None)
+    emitted = {key: readonly(val) if key in node._shared_ports else val for key, val in emitted.items()}
+    return emitted if ctr is None else (emitted, ctr)
+
+def share_fanout(compilation):
+    """
+    Marks arrays emitted by macro children on ports with several consumers (at least one of them outside the macro) read-only.
+    Within a process all consumers then get the very same array, consumers that need to change it copy it first (see utils.writable).
+    """
+    shared = False
+    for n in compilation.nodes:
+        record = membership(n)
+        if record is None:
+            continue
+        consumers = {}
+        for con in n.output_connections:
+            consumers.setdefault(con._emit_port.key, []).append(con._recv_node)
+        ports = set(key for key, recv in consumers.items()
+            if len(recv) > 1 and any(getattr(membership(r), 'outer', None) is not record.outer for r in recv))
+
+        if len(ports) > 0:
+            # only valid for the consumers of this compilation
+            n._shared_ports = ports
+            compilation.on_release(partial(n.__dict__.pop, '_shared_ports', None))
+        shared = shared or len(ports) > 0
+    return shared
@@ -0,0 +1,132 @@
+from livenodes import Node, Producer, Attr
+from ..utils.membership import macro_parents
+
+
+class Fused(Node, abstract_class=True):
+    """
+    Runs a linear chain of macro children as a single node.
+    Each child's process is called directly, skipping the message handoff, queueing and clock bookkeeping between them.
+    """
+    category = "Meta"
+    description = ""
+
+    # fused classes only differ in their ports, thus they are shared between chains of the same node classes
+    _classes = {}
+
+    def __init__(self, chain, links, name="Fused", **kwargs):
+        super().__init__(name, **kwargs)
+        self.chain = chain
+        self.links = links
+        # inputs each following child requires, mirroring Node._should_process (non-optional or connected)
+        self.required = [None] + [
+            set(p.key for p in n.ports_in if not p.optional or p.key in [recv for _, recv in link])
+            for n, link in zip(chain[1:], links)
+        ]
+
+    @classmethod
+    def from_chain(cls, chain):
+        head, tail = chain[0], chain[-1]
+        key = (head.__class__, tail.__class__)
+        if key not in cls._classes:
+            cls._classes[key] = type("Fused", (cls, ), {"ports_in": head.ports_in, "ports_out": tail.ports_out})
+        links = [[(con._emit_port.key, con._recv_port.key) for con in a.output_connections] for a in chain[:-1]]
+        fused = cls._classes[key](chain, links, compute_on=head.compute_on, should_time=head.should_time)
+        # the children names are already unique (and may contain reserved characters due to the macro suffix), thus we set it after validation
+        fused.name = '+'.join(n.name for n in chain)
+        return fused
+
+    def process(self, _ctr=None, **kwargs):
+        data, emit_ctr = kwargs, None
+        last = len(self.chain) - 1
+        for i, node in enumerate(self.chain):
+            node._ctr = _ctr
+            res = node._call_user_fn_process(node.process, 'process', **data, _ctr=_ctr)
+            if res is None:
+                return None
+            if type(res) == tuple:
+                res, emit_ctr = res
+                _ctr = emit_ctr
+            if i == last:
+                break
+            data = {recv: res[emit] for emit, recv in self.links[i] if emit in res}
+            if not self.required[i + 1] <= data.keys():
+                # the next child would not have processed this, ie neither can any following one
+                return None
+        if emit_ctr is not None:
+            return res, emit_ctr
+        return res
+
+    def _onstart(self):
+        for n in self.chain:
+            n._onstart()
+
+    def _onbeforestop(self):
+        for n in self.chain:
+            n._onbeforestop()
+
+    def _onstop(self):
+        for n in self.chain:
+            n._onstop()
+
+    def _onbeforefinish(self):
+        for n in self.chain:
+            n._onbeforefinish()
+
+    def _onfinish(self):
+        for n in self.chain:
+            n._onfinish()
+
+
+def _fuse_macros(node):
+    # fused children are not called individually anymore, thus instrumented and recorded macros are kept as they are to report per child metrics and record their boundary
+    return set(id(m) for m in macro_parents(node) if getattr(m, 'fuse', False) and getattr(m, '_metrics', None) is None and getattr(m, '_recorder', None) is None)
+
+def _fusable(node):
+    # nodes that emit on their own or decide themselves when to process cannot be called as a plain function
+    cls = node.__class__
+    return len(node.ports_in) > 0 \
+        and len(_fuse_macros(node)) > 0 \
+        and not isinstance(node, Producer) \
+        and cls._process is Node._process \
+        and cls._should_process is Node._should_process \
+        and cls._emit_data is Node._emit_data \
+        and Attr.circ_breaker not in node.attrs \
+        and Attr.ctr_increase not in node.attrs
+
+def _successor(node, candidates):
+    if len(node.output_connections) == 0:
+        return None
+    nxt = node.output_connections[0]._recv_node
+    if id(nxt) not in candidates or nxt is node \
+        or any(con._recv_node is not nxt for con in node.output_connections) \
+        or any(con._emit_node is not node for con in nxt.input_connections) \
+        or nxt.compute_on != node.compute_on \
+        or len(_fuse_macros(node) & _fuse_macros(nxt)) == 0:
+        return None
+    return nxt
+
+def fuse_chains(compilation):
+    candidates = {id(n): n for n in compilation.nodes if _fusable(n)}
+    successors = {id(n): _successor(n, candidates) for n in candidates.values()}
+    has_predecessor = set(id(s) for s in successors.values() if s is not None)
+
+    fused = False
+    for n in candidates.values():
+        if id(n) in has_predecessor:
+            continue
+        chain = [n]
+        while successors[id(chain[-1])] is not None and successors[id(chain[-1])] not in chain:
+            chain.append(successors[id(chain[-1])])
+        if len(chain) < 2:
+            continue
+
+        node = Fused.from_chain(chain)
+        for con in list(chain[0].input_connections):
+            compilation.rewire(con, recv_node=node)
+        for con in list(chain[-1].output_connections):
+            compilation.rewire(con, emit_node=node)
+        compilation.remove_nodes(chain)
+        compilation.add_node(node)
+        node.info(f'Fused {len(chain)} nodes: {[str(x) for x in chain]}')
+        fused = True
+    return fused
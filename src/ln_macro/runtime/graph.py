@@ -0,0 +1,56 @@
+from livenodes import Graph
+
+from .compile import compile_graph
+
+
+def materialize_all(node):
+    """
+    Creates the sub-graphs of all lazy macros connected to node (including lazy macros nested within them).
+    Returns a node of the processing graph to start discovering from, as node itself might be a macro.
+    """
+    while True:
+        if hasattr(node, 'get_non_macro_node'):
+            node = node.get_non_macro_node()
+        lazy = [n for n in node.discover_graph(node) if getattr(n, '_lazy', False)]
+        if len(lazy) == 0:
+            return node
+        for m in lazy:
+            m.materialize()
+
+
+class MacroGraph(Graph):
+    """
+    Graph that creates the sub-graphs of lazy macros and compiles the processing graph (e.g. fusing macro children) before starting it.
+    The original topology is restored as soon as the computers are started, so that serialization is not affected.
+    """
+
+    def __init__(self, start_node, compile=True, passes=None, disable=()) -> None:
+        # lazy macros are part of the graph themselves until their sub-graph is created
+        super().__init__(materialize_all(start_node))
+        self.compile = compile
+        self.passes = passes
+        # names of passes to skip, e.g. disable=['elide_passthrough'] to keep all Noops for debugging
+        self.disable = disable
+        self.compilation = None
+
+    def start_all(self, start_timeout=30, stop_timeout=30, close_timeout=30):
+        if not self.compile:
+            return super().start_all(start_timeout=start_timeout, stop_timeout=stop_timeout, close_timeout=close_timeout)
+
+        original_nodes = self.nodes
+        self.compilation = compile_graph(self.nodes, passes=self.passes, disable=self.disable)
+        self.nodes = self.compilation.nodes
+        try:
+            super().start_all(start_timeout=start_timeout, stop_timeout=stop_timeout, close_timeout=close_timeout)
+        except BaseException:
+            self.compilation.restore()
+            raise
+        finally:
+            self.nodes = original_nodes
+        # the nodes are locked and readied at this point, thus they do not use the connections anymore, but still the state the passes set on them
+        self.compilation.restore(release=False)
+
+    def stop_all(self):
+        super().stop_all()
+        if self.compilation is not None:
+            self.compilation.release()
@@ -0,0 +1,204 @@
+import time
+import threading
+import multiprocessing as mp
+
+from ..utils.membership import membership
+
+# values kept per child and per output field, all in one shared array per macro
+CHILD_STATS = ['calls', 'time_total', 'time_max', 'depth', 'depth_max', 'bytes_out']
+OUTPUT_STATS = ['samples', 'latency_count', 'latency_total', 'latency_max', 'first', 'last']
+
+
+class MacroMetrics():
+    """
+    Runtime metrics of one macro, aggregated from its children.
+    The children may run in other processes, thus everything is stored in shared arrays which are created before the graph is started (and inherited by the forked workers).
+
+    Per child: calls and time spent in process, the number of samples waiting in its input queues and the bytes it emitted (of arrays, see runtime.place).
+    Per output field: samples emitted, latency since the sample (ie its ctr) entered any of our inputs and the first/last emission for samples/sec.
+    """
+
+    def __init__(self, macro, window=1024):
+        self.macro = macro
+        self.window = window
+        # replicas share the membership record (and thus the name) of the original, so they are reported together
+        self.children = list(dict.fromkeys(membership(n).name for n in macro.nodes))
+        self.outputs = list(macro.ports_out._fields)
+        self._child_idx = {name: i for i, name in enumerate(self.children)}
+        self._output_idx = {name: i for i, name in enumerate(self.outputs)}
+
+        self._stats = mp.Array('d', len(self.children) * len(CHILD_STATS) + len(self.outputs) * len(OUTPUT_STATS), lock=True)
+        # entry time per ctr, as ring buffer of (ctr, time) pairs, only the most recent window ctrs can be matched to an emission
+        self._entries = mp.Array('d', [-1.0, 0.0] * window, lock=True)
+        # per process: which inputs and outputs of a child cross our boundary
+        self._boundary = {}
+
+    def reset(self):
+        with self._stats.get_lock():
+            self._stats[:] = [0.0] * len(self._stats)
+        with self._entries.get_lock():
+            self._entries[:] = [-1.0, 0.0] * self.window
+
+    # --- worker side ----------------
+    def _boundary_of(self, node):
+        res = self._boundary.get(id(node))
+        if res is None:
+            record = membership(node)
+            outer = lambda other: getattr(membership(other), 'outer', None) is not self.macro
+            entry = any(outer(con._emit_node) for con in node.input_connections)
+            exits = {con._emit_port.key: self._output_idx[record.ports_out[con._emit_port.key]]
+                for con in node.output_connections if outer(con._recv_node) and con._emit_port.key in record.ports_out}
+            res = self._boundary[id(node)] = (entry, exits)
+        return res
+
+    @staticmethod
+    def _queue_depth(node):
+        depth = 0
+        for bridge in getattr(getattr(node, 'data_storage', None), 'in_bridges', {}).values():
+            depth += len(bridge._read)
+            try:
+                depth += bridge.queue.qsize()
+            except (AttributeError, NotImplementedError):
+                # e.g. mp queues on macos
+                pass
+        return depth
+
+    def _call(self, node, fn, _fn, _fn_name, *args, **kwargs):
+        # wraps the process calls of all our children (see MacroChild), livenodes' own timing (should_time) wraps the same function
+        depth = self._queue_depth(node)
+        start = time.perf_counter()
+        res = fn(_fn, _fn_name, *args, **kwargs)
+        end = time.perf_counter()
+
+        ctr = kwargs.get('_ctr')
+        entry, exits = self._boundary_of(node)
+        if entry and ctr is not None:
+            self._enter(ctr, start)
+        emitted, emit_ctr = (res if type(res) == tuple else (res, None)) if res is not None else ({}, None)
+        self._add_call(self._child_idx[membership(node).name], end - start, depth, sum(getattr(val, 'nbytes', 0) for val in emitted.values()))
+
+        if len(exits) > 0:
+            emit_ctr = ctr if emit_ctr is None else emit_ctr
+            for key in emitted:
+                if key in exits:
+                    self._add_exit(exits[key], emit_ctr, end)
+        return res
+
+    def _enter(self, ctr, t):
+        i = 2 * (ctr % self.window)
+        with self._entries.get_lock():
+            # multiple inputs may receive the same ctr, the sample entered with the first one
+            if self._entries[i] != ctr:
+                self._entries[i] = ctr
+                self._entries[i + 1] = t
+
+    def _add_call(self, idx, duration, depth, nbytes):
+        s = idx * len(CHILD_STATS)
+        with self._stats.get_lock():
+            self._stats[s] += 1
+            self._stats[s + 1] += duration
+            self._stats[s + 2] = max(self._stats[s + 2], duration)
+            self._stats[s + 3] = depth
+            self._stats[s + 4] = max(self._stats[s + 4], depth)
+            self._stats[s + 5] += nbytes
+
+    def _add_exit(self, idx, ctr, t):
+        latency = None
+        if ctr is not None:
+            i = 2 * (ctr % self.window)
+            with self._entries.get_lock():
+                if self._entries[i] == ctr:
+                    latency = t - self._entries[i + 1]
+
+        s = len(self.children) * len(CHILD_STATS) + idx * len(OUTPUT_STATS)
+        with self._stats.get_lock():
+            self._stats[s] += 1
+            if latency is not None:
+                self._stats[s + 1] += 1
+                self._stats[s + 2] += latency
+                self._stats[s + 3] = max(self._stats[s + 3], latency)
+            if self._stats[s + 4] == 0:
+                self._stats[s + 4] = t
+            self._stats[s + 5] = t
+
+    # --- reading ----------------
+    def snapshot(self):
+        """
+        Current metrics as plain dict, means and rates are computed from the totals so far.
+        """
+        with self._stats.get_lock():
+            stats = list(self._stats)
+
+        children = {}
+        for i, name in enumerate(self.children):
+            calls, total, t_max, depth, depth_max, nbytes = stats[i * len(CHILD_STATS):(i + 1) * len(CHILD_STATS)]
+            children[name] = {
+                "calls": int(calls),
+                "process_time": total,
+                "process_time_mean": total / calls if calls > 0 else None,
+                "process_time_max": t_max,
+                "queue_depth": int(depth),
+                "queue_depth_max": int(depth_max),
+                "bytes_out_mean": nbytes / calls if calls > 0 else None,
+            }
+
+        outputs = {}
+        offset = len(self.children) * len(CHILD_STATS)
+        for i, name in enumerate(self.outputs):
+            samples, n_lat, lat_total, lat_max, first, last = stats[offset + i * len(OUTPUT_STATS):offset + (i + 1) * len(OUTPUT_STATS)]
+            if samples == 0:
+                continue
+            outputs[name] = {
+                "samples": int(samples),
+                "samples_per_sec": (samples - 1) / (last - first) if last > first else None,
+                "latency_mean": lat_total / n_lat if n_lat > 0 else None,
+                "latency_max": lat_max if n_lat > 0 else None,
+            }
+
+        return {
+            "macro": str(self.macro),
+            "time": time.time(),
+            "process_time": sum(c["process_time"] for c in children.values()),
+            "children": children,
+            "outputs": outputs,
+        }
+
+
+class MetricsReporter():
+    """
+    Calls callback with the snapshots of all given macros every interval seconds, until stopped.
+    """
+
+    def __init__(self, macros, callback, interval=1.0):
+        self.macros = list(macros)
+        self.callback = callback
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def snapshot(self):
+        return [m.metrics() for m in self.macros]
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.callback(self.snapshot())
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        # the last state is always reported, so that short runs are not lost
+        self.callback(self.snapshot())
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,134 @@
+import numpy as np
+from livenodes import Node, Producer
+
+from .place import _topological
+
+
+def _samples(value, chunk_size):
+    # paths are memory-mapped, such that only the chunks that are processed are read
+    if isinstance(value, str):
+        value = np.load(value, mmap_mode='r')
+    if isinstance(value, np.ndarray):
+        return (value[i:i + chunk_size] for i in range(0, len(value), chunk_size))
+    return iter(value)
+
+def _check(node):
+    # same restrictions as for fusing, the node has to be callable as a plain function (see runtime.fuse)
+    cls = node.__class__
+    if isinstance(node, Producer) or cls._process is not Node._process or cls._should_process is not Node._should_process or cls._emit_data is not Node._emit_data:
+        raise ValueError(f'{str(node)} emits on its own or decides itself when to process and thus cannot be run offline')
+
+
+class OfflinePlan():
+    """
+    Order and connections of a macro's children, resolved once such that each sample only costs the children's process calls.
+    """
+
+    def __init__(self, macro, inputs, outputs=None):
+        self.macro = macro
+        self.nodes = _topological(macro.nodes)
+        for n in self.nodes:
+            _check(n)
+        own = set(map(id, self.nodes))
+
+        unknown = [field for field in inputs if field not in macro.ports_in._fields] \
+            + [field for field in outputs or [] if field not in macro.ports_out._fields]
+        if len(unknown) > 0:
+            raise ValueError(f'{str(macro)} has no ports {unknown}')
+        # field -> (node, port key)
+        self.inputs = {field: (macro.own_in_port_to_ref[field][0], macro.own_in_port_to_ref[field][2].key) for field in inputs}
+        outputs = list(macro.ports_out._fields) if outputs is None else list(outputs)
+        self.outputs = {}
+        for field in outputs:
+            n, _, port = macro.own_out_port_to_ref[field]
+            self.outputs.setdefault((id(n), port.key), []).append(field)
+
+        # (id(node), emit port key) -> [(receiving node, recv port key)]
+        self.links = {}
+        fed = {}
+        for n in self.nodes:
+            for con in n.input_connections:
+                if id(con._emit_node) in own:
+                    self.links.setdefault((id(con._emit_node), con._emit_port.key), []).append((con._recv_node, con._recv_port.key))
+                    fed.setdefault(id(n), set()).add(con._recv_port.key)
+        for n, key in self.inputs.values():
+            fed.setdefault(id(n), set()).add(key)
+        # inputs each child requires, mirroring Node._should_process (non-optional or connected)
+        self.required = {id(n): set(p.key for p in n.ports_in if not p.optional or p.key in fed.get(id(n), set())) for n in self.nodes}
+
+    def step(self, ctr, sample):
+        """
+        Runs one sample (field -> value) through the children, returns the emitted outputs (field -> value).
+        """
+        data = {id(n): {} for n in self.nodes}
+        for field, value in sample.items():
+            n, key = self.inputs[field]
+            data[id(n)][key] = value
+
+        res = {}
+        for n in self.nodes:
+            current = data[id(n)]
+            if len(current) == 0 or not self.required[id(n)] <= current.keys():
+                continue
+            n._ctr = ctr
+            emitted = n._call_user_fn_process(n.process, 'process', **current, _ctr=ctr)
+            if emitted is None:
+                continue
+            if type(emitted) == tuple:
+                emitted, _ = emitted
+            for key, val in emitted.items():
+                for recv, recv_key in self.links.get((id(n), key), []):
+                    data[id(recv)][recv_key] = val
+                for field in self.outputs.get((id(n), key), []):
+                    res[field] = val
+        return res
+
+
+def run_offline(macro, inputs, chunk_size=1, outputs=None, stream=False):
+    """
+    Runs macro's sub-graph synchronously in the calling thread, without starting any threads or processes or sending messages between the children.
+    inputs maps our input fields to a list of samples, an array (split into samples of chunk_size rows along the first axis) or the path of a .npy file (which is memory-mapped).
+    Returns the values emitted per output field (default: all), with stream=True a generator of (ctr, outputs) per sample instead.
+    """
+    plan = OfflinePlan(macro, inputs, outputs=outputs)
+    run = _run(plan, {field: _samples(value, chunk_size) for field, value in inputs.items()})
+    if stream:
+        return run
+    res = {field: [] for fields in plan.outputs.values() for field in fields}
+    for _, emitted in run:
+        for field, val in emitted.items():
+            res[field].append(val)
+    return res
+
+def _run(plan, iters):
+    for n in plan.nodes:
+        n._onstart()
+    finished = False
+    try:
+        ctr = 0
+        while len(iters) > 0:
+            sample = {}
+            for field, it in list(iters.items()):
+                try:
+                    sample[field] = next(it)
+                except StopIteration:
+                    # inputs may have different lengths, the others continue on their own
+                    del iters[field]
+            if len(sample) == 0:
+                break
+            emitted = plan.step(ctr, sample)
+            if len(emitted) > 0:
+                yield ctr, emitted
+            ctr += 1
+        for n in plan.nodes:
+            n._onbeforefinish()
+        finished = True
+    finally:
+        # same order as a node running in a graph, the stop hooks also run if a stream is abandoned or a child raises
+        for n in plan.nodes:
+            n._onbeforestop()
+        for n in plan.nodes:
+            n._onstop()
+        if finished:
+            for n in plan.nodes:
+                n._onfinish()
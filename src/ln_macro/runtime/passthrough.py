@@ -0,0 +1,27 @@
+from .record import is_recorded
+
+
+def _is_passthrough(node):
+    # nodes mark themselves as only forwarding their single input to their single output, see Noop
+    return getattr(node.__class__, 'passthrough', False) \
+        and len(node.ports_in) == 1 \
+        and len(node.ports_out) == 1
+
+def elide_passthrough(compilation):
+    elided = []
+    for node in compilation.nodes:
+        # recorded macros keep all their children, as the samples are recorded where they enter and leave them
+        if not _is_passthrough(node) or len(node.input_connections) != 1 or is_recorded(node):
+            continue
+        inp = node.input_connections[0]
+        if not all(inp._emit_port.can_input_to(con._recv_port) for con in node.output_connections):
+            continue
+
+        for con in list(node.output_connections):
+            compilation.rewire(con, emit_node=inp._emit_node, emit_port=inp._emit_port)
+        compilation.disconnect(inp)
+        elided.append(node)
+        node.debug('Elided pass-through node')
+
+    compilation.remove_nodes(elided)
+    return len(elided) > 0
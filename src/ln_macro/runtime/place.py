@@ -0,0 +1,139 @@
+import os
+
+from ..utils.membership import membership, macro_parents
+
+import logging
+logger = logging.getLogger('livenodes')
+
+AUTO = "auto"
+# cost model of sending one sample to another process: fixed overhead per message plus the time to copy its payload
+MESSAGE_COST = 5e-5
+BYTE_COST = 1e-9
+# cost per call assumed for children that were never measured
+DEFAULT_COST = 1e-3
+
+
+def auto_location(i):
+    # the first partition stays with the rest of the graph, the others get a process each
+    return "" if i == 0 else f"{AUTO}-{i}:"
+
+def _transfer(nbytes):
+    return MESSAGE_COST + BYTE_COST * nbytes
+
+def partition(names, edges, costs, edge_bytes, cores, inputs=(), outputs=()):
+    """
+    Assigns each node (by name, in topological order) to one of at most cores partitions.
+    List scheduling of a single sample: each node goes to the partition on which it finishes first, given when its predecessors finish (plus the transfer if they are in another partition) and when the partition is free again.
+    As transfers cost time, nodes are only spread if they can actually run in parallel, which also keeps the bytes sent between processes low.
+    edges are (emit, recv) pairs, inputs and outputs the nodes connected to the rest of the graph (which runs in partition 0).
+    """
+    preds = {name: [] for name in names}
+    for emit, recv in edges:
+        preds[recv].append(emit)
+    inputs, outputs = set(inputs), set(outputs)
+
+    assignment, finish, free = {}, {}, [0.0] * max(1, cores)
+    n_used = 1
+    for name in names:
+        best = None
+        # empty partitions all give the same result, thus only the first one is considered
+        for p in range(min(n_used + 1, len(free))):
+            start = free[p]
+            for pred in preds[name]:
+                if pred not in assignment:
+                    # closes a cycle, ie does not hold up this sample
+                    continue
+                start = max(start, finish[pred] + (_transfer(edge_bytes.get(pred, 0)) if assignment[pred] != p else 0))
+            if name in inputs and p != 0:
+                # the input is sent by the rest of the graph
+                start = max(start, _transfer(0))
+            end = start + costs.get(name, DEFAULT_COST)
+            # the output is sent back to the rest of the graph
+            arrival = end + (_transfer(edge_bytes.get(name, 0)) if name in outputs and p != 0 else 0)
+            if best is None or arrival < best[0]:
+                best = (arrival, end, p)
+        _, end, p = best
+        assignment[name], finish[name], free[p] = p, end, end
+        n_used = max(n_used, p + 1)
+    latency = max([finish[name] + (_transfer(edge_bytes.get(name, 0)) if assignment[name] != 0 else 0) for name in outputs] or list(finish.values()) or [0.0])
+    cross = sum(edge_bytes.get(emit, 0) for emit, recv in edges if assignment[emit] != assignment[recv]) \
+        + sum(edge_bytes.get(name, 0) for name in outputs if assignment[name] != 0)
+    loads = [0.0] * n_used
+    for name, p in assignment.items():
+        loads[p] += costs.get(name, DEFAULT_COST)
+    return assignment, {"latency": latency, "cross_bytes": cross, "loads": loads}
+
+
+def plan_placement(macro, costs=None, edge_bytes=None, cores=None):
+    """
+    Computes the locations of macro's children, see partition.
+    Per default the costs and payload sizes are taken from the macro's metrics (see MacroHelper.instrument), children that were not measured get DEFAULT_COST and no payload.
+    """
+    measured_costs, measured_bytes = _measured(macro)
+    nodes = macro.nodes
+    names = [membership(n).name for n in _topological(nodes)]
+    if costs is None:
+        costs = measured_costs
+        missing = [name for name in names if name not in costs]
+        if len(missing) > 0:
+            logger.warning(f'{str(macro)}: no cost measured for {missing}, assuming {DEFAULT_COST}s per call')
+    if edge_bytes is None:
+        edge_bytes = measured_bytes
+    if cores is None:
+        cores = os.cpu_count() or 1
+
+    own = set(map(id, nodes))
+    name = lambda n: membership(n).name
+    edges = list(dict.fromkeys((name(con._emit_node), name(n)) for n in nodes for con in n.input_connections if id(con._emit_node) in own))
+    inputs = [name(n) for n in nodes if any(id(con._emit_node) not in own for con in n.input_connections)]
+    outputs = [name(n) for n in nodes if any(id(con._recv_node) not in own for con in n.output_connections)]
+
+    assignment, report = partition(names, edges, costs, edge_bytes, cores, inputs=inputs, outputs=outputs)
+    report["placement"] = {name: auto_location(p) for name, p in assignment.items()}
+    return report
+
+def _measured(macro):
+    # (costs, edge_bytes) by child name, only those children that processed at least once while instrumented
+    snapshot = macro.metrics()
+    measured = snapshot["children"] if snapshot is not None else {}
+    costs = {name: child["process_time_mean"] for name, child in measured.items() if child["process_time_mean"] is not None}
+    edge_bytes = {name: child["bytes_out_mean"] for name, child in measured.items() if child["bytes_out_mean"] is not None}
+    return costs, edge_bytes
+
+def _topological(nodes):
+    own = set(map(id, nodes))
+    pending = {id(n): sum(1 for con in n.input_connections if id(con._emit_node) in own) for n in nodes}
+    ready = [n for n in nodes if pending[id(n)] == 0]
+    order = []
+    while len(ready) > 0:
+        n = ready.pop(0)
+        order.append(n)
+        for con in n.output_connections:
+            if id(con._recv_node) in pending:
+                pending[id(con._recv_node)] -= 1
+                if pending[id(con._recv_node)] == 0:
+                    ready.append(con._recv_node)
+    # cycles (ie nodes that break them) are placed last
+    seen = set(map(id, order))
+    return order + [n for n in nodes if id(n) not in seen]
+
+
+def place_macros(compilation):
+    """
+    Places the children of macros with compute_on="auto" that do not have a frozen placement yet, based on what was measured so far.
+    Macros without any measurement keep their children where they are, as a placement based on guessed costs only is not better than none.
+    """
+    macros = {}
+    for n in compilation.nodes:
+        for m in macro_parents(n):
+            if m.compute_on == AUTO and m.placement is None:
+                macros[id(m)] = m
+
+    placed = 0
+    for m in macros.values():
+        if len(_measured(m)[0]) == 0:
+            logger.warning(f'{str(m)} was not measured yet, its children are not placed (instrument it and run the graph, or call place() with costs)')
+            continue
+        m.place()
+        placed += 1
+    return placed > 0
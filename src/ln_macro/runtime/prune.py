@@ -0,0 +1,32 @@
+from livenodes import View
+
+from ..utils.membership import membership
+
+
+def has_side_effects(node):
+    # nodes opt out of pruning by setting side_effects = True (e.g. nodes writing to disk), views and sinks are kept anyway
+    return getattr(node, 'side_effects', False) \
+        or isinstance(node, View) \
+        or len(node.ports_out) == 0
+
+def prune_dead_outputs(compilation):
+    """
+    Removes macro children whose outputs do not (transitively) reach a connected macro output or a node with side effects.
+    Macros expose the outputs of all their children, most of which are usually not used.
+    """
+    live = [n for n in compilation.nodes if membership(n) is None or has_side_effects(n)]
+    seen = set(map(id, live))
+    while len(live) > 0:
+        node = live.pop()
+        for con in node.input_connections:
+            if id(con._emit_node) not in seen:
+                seen.add(id(con._emit_node))
+                live.append(con._emit_node)
+
+    dead = [n for n in compilation.nodes if id(n) not in seen]
+    for n in dead:
+        for con in list(n.input_connections):
+            compilation.disconnect(con)
+        n.debug('Pruned, as its outputs are not used')
+    compilation.remove_nodes(dead)
+    return len(dead) > 0
@@ -0,0 +1,273 @@
+import os
+import glob
+import json
+import time
+import pickle
+import threading
+
+import numpy as np
+from livenodes import Node
+from livenodes.producer import Producer
+from ln_ports import Ports_empty
+
+from .graph import MacroGraph
+from .replicate import _ports
+from ..utils.membership import membership
+
+META_FILE = 'meta.json'
+# arrays with more dimensions (and all other values) are pickled
+MAX_DIMS = 8
+# one fixed size record per sample, the payload itself is appended to the column's .bin file
+INDEX_DTYPE = np.dtype([
+    ('ctr', '<i8'), ('time', '<f8'), ('offset', '<i8'), ('nbytes', '<i8'),
+    ('pickled', '?'), ('dtype', 'S16'), ('ndim', '<i1'), ('shape', '<i8', (MAX_DIMS,)),
+])
+
+
+class _Column():
+    # append only, opened per process (and field) and unbuffered, as workers may exit without flushing
+    def __init__(self, directory, column):
+        prefix = os.path.join(directory, f"{column}.{os.getpid()}")
+        self._bin = open(f"{prefix}.bin", 'ab', buffering=0)
+        self._idx = open(f"{prefix}.idx", 'ab', buffering=0)
+        self._offset = self._bin.tell()
+
+    def write(self, ctr, t, value):
+        rec = np.zeros(1, dtype=INDEX_DTYPE)
+        if isinstance(value, np.ndarray) and not value.dtype.hasobject and value.ndim <= MAX_DIMS:
+            value = np.ascontiguousarray(value)
+            payload = value.reshape(-1).view(np.uint8)
+            rec['dtype'], rec['ndim'] = value.dtype.str, value.ndim
+            rec['shape'][0, :value.ndim] = value.shape
+        else:
+            payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            rec['pickled'] = True
+        rec['ctr'] = -1 if ctr is None else ctr
+        rec['time'], rec['offset'], rec['nbytes'] = t, self._offset, len(payload)
+        self._bin.write(payload)
+        self._idx.write(rec.tobytes())
+        self._offset += len(payload)
+
+
+class MacroRecorder():
+    """
+    Records every sample crossing a macro's ports, with its ctr and the time it entered or left the sub-graph.
+    Each field is stored as its own column: an index of fixed size records and the appended payloads, both of which are memory-mapped for reading (see Recording).
+    The children may run in other processes, each of them writes its own files.
+    """
+
+    def __init__(self, macro, directory):
+        self.macro = macro
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, META_FILE), 'w') as f:
+            json.dump({
+                "path": macro.path,
+                "params": macro.params,
+                "inputs": list(macro.ports_in._fields),
+                "outputs": list(macro.ports_out._fields),
+            }, f, default=str)
+        self._columns = {}
+        self._boundary = {}
+        self._lock = threading.Lock()
+
+    # --- worker side ----------------
+    def _boundary_of(self, node):
+        res = self._boundary.get(id(node))
+        if res is None:
+            record = membership(node)
+            outer = lambda other: getattr(membership(other), 'outer', None) is not self.macro
+            # inputs and outputs may have the same field name (e.g. Noop_any), thus the columns are named by direction as well
+            entries = {con._recv_port.key: f"in.{record.ports_in[con._recv_port.key]}"
+                for con in node.input_connections if outer(con._emit_node) and con._recv_port.key in record.ports_in}
+            exits = {con._emit_port.key: f"out.{record.ports_out[con._emit_port.key]}"
+                for con in node.output_connections if outer(con._recv_node) and con._emit_port.key in record.ports_out}
+            res = self._boundary[id(node)] = (entries, exits)
+        return res
+
+    def _write(self, column, ctr, t, value):
+        with self._lock:
+            key = (os.getpid(), column)
+            if key not in self._columns:
+                self._columns[key] = _Column(self.directory, column)
+            self._columns[key].write(ctr, t, value)
+
+    def _call(self, node, fn, _fn, _fn_name, *args, **kwargs):
+        # records the boundary inputs and outputs of our children's process calls, same extension point as runtime.metrics
+        entries, exits = self._boundary_of(node)
+        ctr = kwargs.get('_ctr')
+        t = time.time()
+        for key, column in entries.items():
+            if key in kwargs:
+                self._write(column, ctr, t, kwargs[key])
+
+        res = fn(_fn, _fn_name, *args, **kwargs)
+
+        if res is not None and len(exits) > 0:
+            t = time.time()
+            emitted, emit_ctr = res if type(res) == tuple else (res, None)
+            emit_ctr = ctr if emit_ctr is None else emit_ctr
+            for key, val in emitted.items():
+                if key in exits:
+                    self._write(exits[key], emit_ctr, t, val)
+        return res
+
+
+def is_recorded(node):
+    return getattr(getattr(membership(node), 'outer', None), '_recorder', None) is not None
+
+
+class Recording():
+    """
+    Read access to the directory written by a MacroRecorder.
+    Arrays are returned as read-only views into the memory-mapped files, ie only the samples that are accessed are read from disk.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, META_FILE), 'r') as f:
+            self.meta = json.load(f)
+
+    @property
+    def inputs(self):
+        return [field for field in self.meta['inputs'] if len(self._files(f"in.{field}")) > 0]
+
+    @property
+    def outputs(self):
+        return [field for field in self.meta['outputs'] if len(self._files(f"out.{field}")) > 0]
+
+    def _files(self, column):
+        return sorted(glob.glob(os.path.join(glob.escape(self.directory), f"{glob.escape(column)}.*.idx")))
+
+    def samples(self, field, io='out'):
+        """
+        (ctr, time, value) of all recorded samples of the input (io='in') or output (io='out') field, ordered by ctr.
+        """
+        if io not in ('in', 'out'):
+            raise ValueError(f"Invalid io: {io}")
+        res = []
+        for path in self._files(f"{io}.{field}"):
+            if os.path.getsize(path) == 0:
+                continue
+            index = np.memmap(path, dtype=INDEX_DTYPE, mode='r')
+            payload = np.memmap(f"{path[:-4]}.bin", dtype=np.uint8, mode='r') if index['nbytes'].sum() > 0 else None
+            res.extend((int(rec['ctr']), float(rec['time']), self._decode(rec, payload)) for rec in index)
+        return sorted(res, key=lambda s: (s[0], s[1]))
+
+    @staticmethod
+    def _decode(rec, payload):
+        start, end = rec['offset'], rec['offset'] + rec['nbytes']
+        if rec['pickled']:
+            return pickle.loads(payload[start:end].tobytes())
+        shape = tuple(rec['shape'][:rec['ndim']])
+        if rec['nbytes'] == 0:
+            return np.zeros(shape, dtype=rec['dtype'].decode())
+        return payload[start:end].view(rec['dtype'].decode()).reshape(shape)
+
+
+# --- replay ----------------
+class Replayer(Producer, abstract_class=True):
+    """
+    Emits recorded samples, grouped by their original ctr, either as fast as possible or with pace at the recorded timing.
+    """
+    category = "Meta"
+    description = ""
+
+    def __init__(self, samples, pace=False, name="Replayer", **kwargs):
+        super().__init__(name, **kwargs)
+        # list of (time, {field: value}) in ctr order
+        self.samples = samples
+        self.pace = pace
+
+    @classmethod
+    def create(cls, ports, samples, pace=False, **kwargs):
+        new_cls = type("Replayer", (cls, ), {
+            "ports_out": _ports('Replayer_Ports_Out', ports),
+        })
+        return new_cls(samples, pace=pace, **kwargs)
+
+    def _run(self):
+        start = time.time()
+        first = self.samples[0][0] if len(self.samples) > 0 else 0
+        for t, data in self.samples:
+            if self.pace:
+                delay = (t - first) - (time.time() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            yield self.ret(**data)
+
+
+class ReplayCollector(Node, abstract_class=True):
+    """
+    Keeps everything it receives, one per output field so that differently paced outputs do not need to be synchronized.
+    """
+    category = "Meta"
+    description = ""
+
+    def __init__(self, name="ReplayCollector", **kwargs):
+        super().__init__(name, **kwargs)
+        self.out = []
+
+    @classmethod
+    def create(cls, port, **kwargs):
+        new_cls = type("ReplayCollector", (cls, ), {
+            "ports_in": _ports('ReplayCollector_Ports_In', [("data", port)]),
+            "ports_out": Ports_empty(),
+        })
+        return new_cls(**kwargs)
+
+    def process(self, data, **kwargs):
+        self.out.append(data)
+
+
+def _same(a, b):
+    try:
+        return bool(np.array_equal(np.asarray(a), np.asarray(b)))
+    except Exception:
+        return a == b
+
+def replay(recording, macro=None, pace=False, **kwargs):
+    """
+    Runs macro standalone on the recorded inputs (per default a new instance of the recorded file, a given macro must not be connected to anything else) and compares its outputs to the recorded ones.
+    Returns the outputs per field, the differences per field and how long the run took. kwargs are passed to the MacroGraph (e.g. disable).
+    """
+    if not isinstance(recording, Recording):
+        recording = Recording(recording)
+    if macro is None:
+        # imported here, as the macro itself depends on the runtime
+        from ..macro import Macro
+        macro = Macro(path=recording.meta['path'], params=recording.meta['params'])
+
+    by_ctr = {}
+    for field in recording.inputs:
+        for ctr, t, value in recording.samples(field, io='in'):
+            t_prev, data = by_ctr.setdefault(ctr, (t, {}))
+            data[field] = value
+            by_ctr[ctr] = (min(t, t_prev), data)
+    samples = [by_ctr[ctr] for ctr in sorted(by_ctr)]
+
+    replayer = Replayer.create([(field, getattr(macro.ports_in, field)) for field in recording.inputs], samples, pace=pace)
+    for field in recording.inputs:
+        macro.add_input(replayer, getattr(replayer.ports_out, field), getattr(macro.ports_in, field))
+    collectors = {}
+    for field in recording.outputs:
+        collectors[field] = ReplayCollector.create(getattr(macro.ports_out, field), name=f"ReplayCollector-{field}")
+        collectors[field].add_input(macro, getattr(macro.ports_out, field), collectors[field].ports_in.data)
+
+    start = time.time()
+    g = MacroGraph(start_node=replayer, **kwargs)
+    g.start_all()
+    g.join_all()
+    g.stop_all()
+    duration = time.time() - start
+
+    outputs, diff = {}, {}
+    for field, collector in collectors.items():
+        expected = [value for _, _, value in recording.samples(field)]
+        outputs[field] = collector.out
+        diff[field] = {
+            "expected": len(expected),
+            "got": len(collector.out),
+            "mismatches": [i for i, (a, b) in enumerate(zip(expected, collector.out)) if not _same(a, b)],
+        }
+    return {"duration": duration, "outputs": outputs, "diff": diff}
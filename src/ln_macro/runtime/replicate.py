@@ -0,0 +1,206 @@
+from functools import partial
+
+from livenodes import Node, Ports_collection
+from livenodes.components.computer import parse_location
+from ln_ports import Port_Any
+
+from .shm_bridge import isolated_location
+from ..utils.membership import membership, macro_parents
+
+
+def replica_location(compute_on, i):
+    # every replica gets its own process, replicas of different macros share them
+    host, process, thread = parse_location(compute_on)
+    process = f"{process or 'replica'}-{i}"
+    if host == ':':
+        return f"{process}:{thread}"
+    return f"{host}:{process}:{thread}"
+
+def _ports(name, ports):
+    return type(name, (Ports_collection,), {key: port.__class__(port.label, optional=port.optional, key=key) for key, port in ports})()
+
+
+class Distributor(Node, abstract_class=True):
+    """
+    Sends each sample to exactly one replica, all inputs of a ctr go to the same replica.
+    Per default replicas are chosen round-robin via the ctr, if key is set the value of that input is hashed instead.
+    The chosen replica is sent on the ctl port as well, so that the Mergers know which replica to wait for.
+    """
+    category = "Meta"
+    description = ""
+
+    def __init__(self, replicas, key=None, name="Distributor", **kwargs):
+        super().__init__(name, **kwargs)
+        self.replicas = replicas
+        self.key = key
+
+    @classmethod
+    def create(cls, ports, replicas, key=None, **kwargs):
+        # ports: list of (key, port) of the receiving side
+        new_cls = type("Distributor", (cls, ), {
+            "ports_in": _ports('Distributor_Ports_In', ports),
+            "ports_out": _ports('Distributor_Ports_Out', [(f"r{i}_{key}", port) for i in range(replicas) for key, port in ports] + [("ctl", Port_Any("Replica"))]),
+        })
+        return new_cls(replicas, key=key, **kwargs)
+
+    def process(self, _ctr, **kwargs):
+        if self.key is not None and self.key in kwargs:
+            i = hash(str(kwargs[self.key])) % self.replicas
+        else:
+            i = _ctr % self.replicas
+        return self.ret(ctl=i, **{f"r{i}_{key}": val for key, val in kwargs.items()})
+
+
+class Merger(Node, abstract_class=True):
+    """
+    Merges the outputs of all replicas back into a single stream ordered by ctr.
+    The Distributor tells us on the ctl port which replica each ctr was sent to, a sample is passed on as soon as all earlier ctrs are, a ctr is skipped once its replica sent a later one (ie it did not emit anything for it).
+    Without ctl (ie nothing to distribute), a sample is only passed on once every replica has sent something with the same or a higher ctr. The rest is flushed on finish.
+    """
+    category = "Meta"
+    description = ""
+
+    def __init__(self, replicas, name="Merger", **kwargs):
+        super().__init__(name, **kwargs)
+        self.replicas = replicas
+        self._buffer = {}
+        self._last_seen = {}
+        # (ctr, replica) as sent by the Distributor
+        self._order = []
+
+    @classmethod
+    def create(cls, port, replicas, **kwargs):
+        new_cls = type("Merger", (cls, ), {
+            "ports_in": _ports('Merger_Ports_In', [(f"r{i}", port) for i in range(replicas)] + [("ctl", Port_Any("Replica", optional=True))]),
+            "ports_out": _ports('Merger_Ports_Out', [("out", port)]),
+        })
+        return new_cls(replicas, **kwargs)
+
+    def _should_process(self, **kwargs):
+        return len(kwargs) > 0
+
+    def _distributed(self):
+        return any(con._recv_port.key == 'ctl' for con in self.input_connections)
+
+    def _process(self, ctr):
+        # the replicas run independently, thus ctrs arrive out of order and we cannot use the (asserting) default
+        for key, val in self.data_storage.get(ctr=ctr).items():
+            if key == 'ctl':
+                self._order.append((ctr, val))
+            else:
+                self._buffer[ctr] = val
+                self._last_seen[key] = ctr
+        self.data_storage.discard_before(ctr)
+
+        if self._distributed():
+            self._flush_ordered()
+        elif len(self._last_seen) >= len(self.input_connections):
+            self._flush(min(self._last_seen.values()))
+
+    def _flush_ordered(self, final=False):
+        while len(self._order) > 0:
+            ctr, i = self._order[0]
+            if ctr in self._buffer:
+                self._emit(ctr)
+            elif not final and self._last_seen.get(f"r{i}", -1) <= ctr:
+                return
+            # otherwise the replica already sent later ctrs (or finished), thus it did not emit anything for this one
+            self._order.pop(0)
+
+    def _flush(self, watermark=None):
+        for ctr in sorted(self._buffer):
+            if watermark is not None and ctr > watermark:
+                break
+            self._emit(ctr)
+
+    def _emit(self, ctr):
+        self._ctr = ctr
+        self._emit_data(self._buffer.pop(ctr), channel='out', ctr=ctr)
+
+    def _onbeforefinish(self):
+        self._flush_ordered(final=True)
+        self._flush()
+
+
+def _replicate(compilation, macro):
+    # children removed by earlier passes (e.g. prune_dead_outputs) are not replicated either
+    present = set(map(id, compilation.nodes))
+    children = [n for n in macro.nodes if id(n) in present]
+    template = macro._load_template(macro.path, macro.params)
+    own = set(map(id, children))
+
+    location = isolated_location(macro.compute_on, id(macro)) if macro.isolated else macro.compute_on
+
+    # the originals are the first replica for this compilation only
+    for n in children:
+        compilation.on_release(partial(setattr, n, 'compute_on', n.compute_on))
+        n.compute_on = replica_location(location, 0)
+
+    copies = [dict((id(n), n) for n in children)]
+    for i in range(1, macro.replicas):
+        by_name = {macro._child_name(n): n for n in macro._discover_graph_excl_macros(template.instantiate(macro.params))}
+        mapping = {}
+        for n in children:
+            c = by_name[macro._get_node_name(n)]
+            # names have to be unique in the graph, thus we build on the (unique) name of the original
+            c.name = f"{n.name}-r{i}"
+            c.compute_on = replica_location(location, i)
+            # the copies take the original's place in the macro
+            c.__class__ = n.__class__
+            c._macro = membership(n)
+            mapping[id(n)] = c
+            compilation.add_node(c)
+        copies.append(mapping)
+        # the copies are connected like the whole sub-graph, drop the connections to copies of children that are not replicated
+        copied = set(map(id, mapping.values()))
+        for c in mapping.values():
+            for con in list(c.input_connections) + list(c.output_connections):
+                if id(con._emit_node) not in copied or id(con._recv_node) not in copied:
+                    compilation.disconnect(con)
+
+    # --- inputs: one distributor for all connections into the sub-graph ----------------
+    inputs = [con for n in children for con in n.input_connections if id(con._emit_node) not in own]
+    distributor = None
+    if len(inputs) > 0:
+        ports = [(f"in{j}", con._recv_port) for j, con in enumerate(inputs)]
+        key = None
+        if macro.replica_key is not None:
+            key = next((f"in{j}" for j, con in enumerate(inputs) if macro._encode_node_port(con._recv_node, con._recv_port.key) == macro.replica_key), None)
+        distributor = Distributor.create(ports, macro.replicas, key=key, compute_on=macro.compute_on)
+        distributor.name = f"{macro.name}-distributor"
+        compilation.add_node(distributor)
+        for j, con in enumerate(inputs):
+            in_port = getattr(distributor.ports_in, f"in{j}")
+            compilation.rewire(con, recv_node=distributor, recv_port=in_port)
+            for i, mapping in enumerate(copies):
+                compilation.connect(distributor, getattr(distributor.ports_out, f"r{i}_in{j}"), mapping[id(con._recv_node)], con._recv_port)
+
+    # --- outputs: one merger per used output port ----------------
+    outputs = {}
+    for n in children:
+        for con in n.output_connections:
+            if id(con._recv_node) not in own:
+                outputs.setdefault((id(n), con._emit_port.key), []).append(con)
+    for cons in outputs.values():
+        emit_node, emit_port = cons[0]._emit_node, cons[0]._emit_port
+        merger = Merger.create(emit_port, macro.replicas, compute_on=macro.compute_on)
+        merger.name = f"{macro.name}-merger-{emit_node.name}-{emit_port.key}"
+        compilation.add_node(merger)
+        for i, mapping in enumerate(copies):
+            compilation.connect(mapping[id(emit_node)], emit_port, merger, getattr(merger.ports_in, f"r{i}"))
+        if distributor is not None:
+            compilation.connect(distributor, distributor.ports_out.ctl, merger, merger.ports_in.ctl)
+        for con in cons:
+            compilation.rewire(con, emit_node=merger, emit_port=merger.ports_out.out)
+
+def replicate_macros(compilation):
+    macros = {}
+    for n in compilation.nodes:
+        for m in macro_parents(n):
+            if getattr(m, 'replicas', 1) > 1:
+                macros[id(m)] = m
+
+    for m in macros.values():
+        m.info(f'Replicating {m.replicas} times')
+        _replicate(compilation, m)
+    return len(macros) > 0
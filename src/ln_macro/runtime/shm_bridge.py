@@ -0,0 +1,107 @@
+import queue
+import weakref
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+from livenodes.components.bridges import Bridge_process
+from livenodes.components.computer import parse_location
+
+# processes with this prefix host an isolated macro, connections into and out of them are bridged via shared memory
+SHM_PREFIX = "shm-"
+
+def isolated_location(compute_on, key):
+    host, process, thread = parse_location(compute_on)
+    process = f"{SHM_PREFIX}{process or key}"
+    if host == ':':
+        return f"{process}:{thread}"
+    return f"{host}:{process}:{thread}"
+
+
+class ShmRef():
+    # what is actually sent through the queue in place of an array
+    def __init__(self, slot, shape, dtype):
+        self.slot = slot
+        self.shape = shape
+        self.dtype = dtype
+
+
+class ShmClosed():
+    # sent as last item, so that the receiver only considers the bridge closed once everything before was read
+    pass
+
+
+class Bridge_shm(Bridge_process):
+    """
+    Process bridge that moves numpy arrays through a shared memory ring instead of pickling them.
+    Arrays are received as read-only views into the ring, a slot is only reused once the received view is garbage collected.
+    Everything else (and arrays that do not fit or arrive while the ring is full) is sent as in Bridge_process.
+    """
+    slots = 16
+    slot_bytes = 4 * 2**20
+
+    # _build thread
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        # created here, as livenodes forks its processes, thus both ends inherit the mapping
+        # the pages are only backed once they are written to, ie the ring does not cost its full size
+        self.shm = shared_memory.SharedMemory(create=True, size=self.slots * self.slot_bytes)
+        self.free_slots = mp.Queue()
+        for i in range(self.slots):
+            self.free_slots.put(i)
+
+        # _to thread
+        self._closed_received = False
+
+    @staticmethod
+    def can_handle(_from, _to, _data_type=None):
+        from_host, from_process, from_thread = parse_location(_from)
+        to_host, to_process, to_thread = parse_location(_to)
+        isolated = from_process.startswith(SHM_PREFIX) or to_process.startswith(SHM_PREFIX)
+        return from_host == to_host and from_process != to_process and isolated, 3
+
+    # _from thread
+    def put(self, ctr, item):
+        if isinstance(item, np.ndarray) and not item.dtype.hasobject and item.nbytes <= self.slot_bytes:
+            try:
+                slot = self.free_slots.get_nowait()
+            except queue.Empty:
+                slot = None
+            if slot is not None:
+                view = np.ndarray(item.shape, dtype=item.dtype, buffer=self.shm.buf, offset=slot * self.slot_bytes)
+                view[...] = item
+                del view
+                item = ShmRef(slot, item.shape, item.dtype)
+        self.queue.put_nowait((ctr, item))
+
+    def close(self):
+        if self.closed_event.is_set():
+            return
+        super().close()
+        # the closed event may arrive before the data still buffered in the queue's feeder, thus we also send a marker through the queue itself
+        self.queue.put_nowait((None, ShmClosed()))
+        try:
+            # only removes the name, both ends keep their mapping as long as views exist
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    # _to thread
+    def closed(self):
+        return self._closed_received
+
+    # _to thread
+    async def update(self):
+        itm_ctr = await super().update()
+        while isinstance(self._read.get(itm_ctr), ShmClosed):
+            del self._read[itm_ctr]
+            self._closed_received = True
+            itm_ctr = await super().update()
+        item = self._read[itm_ctr]
+        if isinstance(item, ShmRef):
+            base = np.ndarray(item.shape, dtype=item.dtype, buffer=self.shm.buf, offset=item.slot * self.slot_bytes)
+            base.flags.writeable = False
+            # the slot is free again once no-one references the view anymore
+            weakref.finalize(base, self.free_slots.put, item.slot)
+            self._read[itm_ctr] = base
+        return itm_ctr
@@ -0,0 +1,7 @@
+from .template_cache import MacroTemplate, TemplateCache, template_cache
+from .names import MacroNameRegistry
+from .manifest import read_manifest, write_manifest, ports_to_manifest, ports_from_manifest
+from .membership import MacroMembership, membership, macro_parents
+from .bulk import bulk_load
+from .readonly import readonly, writable
+from .library import MacroLibrary, library_manifest
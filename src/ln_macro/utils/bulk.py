@@ -0,0 +1,12 @@
+from livenodes import Node
+
+from .template_cache import template_cache, macro_paths
+
+
+def bulk_load(dct, max_workers=None, **kwargs):
+    """
+    Same as Node.from_compact_dict, but all macro files referenced by the graph (and nested in them) are read and parsed concurrently up front.
+    Each file is only loaded once, the macros are then created from the cached templates.
+    """
+    template_cache.prefetch(macro_paths(dct), max_workers=max_workers)
+    return Node.from_compact_dict(dct, **kwargs)
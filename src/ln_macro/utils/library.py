@@ -0,0 +1,205 @@
+import os
+import re
+import json
+import tempfile
+import threading
+
+from .template_cache import template_cache, macro_paths
+from .manifest import ports_to_manifest, ports_from_manifest
+
+import logging
+logger = logging.getLogger('livenodes')
+
+# stored in the library's root folder, entries are keyed by the path relative to it
+INDEX_FILE = '.ln_macro_index.json'
+INDEX_VERSION = 1
+EXTENSIONS = ('.yml', '.json')
+NODE_CLASS = re.compile(r'\[(.+)\]$')
+SIDECAR_SUFFIX = '.ports.yml'
+
+
+def _dependencies(template, seen=None):
+    # content hashes of all macro files nested in template, the exposed ports depend on them as well
+    seen = {} if seen is None else seen
+    for path in macro_paths(template.dct, template.folder):
+        key = template_cache.resolve(path)
+        if key not in seen and os.path.exists(key):
+            nested = template_cache.get(key)
+            seen[key] = nested.content_hash
+            _dependencies(nested, seen)
+    return seen
+
+
+class MacroLibrary():
+    """
+    Persistent index of all macro files in a folder (and its sub-folders): name, exposed ports and child node classes per file.
+    Lets palettes list and describe macros without creating them. Only files whose mtime or size changed are read again on scan, and only those whose content changed are described again.
+    Macros of indexed files also take their ports from the index instead of instantiating their sub-graph (see library_manifest).
+    """
+
+    def __init__(self, folder, index_path=None):
+        self.folder = os.path.realpath(folder)
+        self.index_path = index_path or os.path.join(self.folder, INDEX_FILE)
+        self._entries = None
+
+    # --- index ----------------
+    def _load(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+            if index.get('version') == INDEX_VERSION:
+                return index['entries']
+        except FileNotFoundError:
+            pass
+        return {}
+
+    def _save(self):
+        # write to a temporary file first, so that concurrent readers never see a partial index
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.index_path), suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({"version": INDEX_VERSION, "entries": self._entries}, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.index_path)
+
+    def entries(self):
+        if self._entries is None:
+            self._entries = self._load()
+        return self._entries
+
+    def _files(self):
+        res = []
+        for root, dirs, files in os.walk(self.folder):
+            dirs[:] = sorted(d for d in dirs if not d.startswith('.'))
+            for f in sorted(files):
+                path = os.path.join(root, f)
+                # port manifests next to the macro files (see utils.manifest) are not macros themselves
+                if f.endswith(EXTENSIONS) and not f.startswith('.') and not f.endswith(SIDECAR_SUFFIX):
+                    res.append(os.path.relpath(path, self.folder))
+        return res
+
+    # --- scanning ----------------
+    def scan(self, max_workers=None):
+        """
+        Brings the index up to date with the folder and saves it if anything changed.
+        Returns the relative paths of the added, updated and removed files.
+        """
+        entries = self.entries()
+        files = self._files()
+        changed = {}
+        for rel in files:
+            stat = os.stat(os.path.join(self.folder, rel))
+            entry = entries.get(rel)
+            if entry is None or entry['mtime'] != stat.st_mtime_ns or entry['size'] != stat.st_size:
+                changed[rel] = stat
+
+        # read and parse all changed files (and the macros nested in them) concurrently
+        templates = template_cache.prefetch([os.path.join(self.folder, rel) for rel in changed], max_workers=max_workers)
+        res = {"added": [], "updated": [], "removed": []}
+        for rel, stat in changed.items():
+            path = os.path.join(self.folder, rel)
+            template = templates[template_cache.resolve(path)]
+            entry = entries.get(rel)
+            if entry is None or entry['content_hash'] != template.content_hash:
+                res["updated" if entry is not None else "added"].append(rel)
+                entry = entries[rel] = self._describe(path, template)
+            # otherwise the file was touched, but not changed
+            entry['mtime'], entry['size'] = stat.st_mtime_ns, stat.st_size
+
+        for rel in list(entries):
+            if rel not in files:
+                del entries[rel]
+                res["removed"].append(rel)
+
+        if len(changed) > 0 or len(res["removed"]) > 0 or not os.path.exists(self.index_path):
+            self._save()
+        return res
+
+    def _describe(self, path, template):
+        # imported here, as the macro depends on this module to look up the ports
+        from ..macro import MacroHelper
+        nodes = template.dct.get('Nodes')
+        entry = {
+            "content_hash": template.content_hash,
+            "name": MacroHelper.default_name(None, path),
+            "classes": sorted(set(NODE_CLASS.search(key).group(1) for key in nodes if NODE_CLASS.search(key))) if isinstance(nodes, dict) else [],
+            "params": template.params,
+            "ports": None,
+            "dependencies": {},
+            "error": None,
+        }
+        try:
+            # uses the manifest if there is one, otherwise the sub-graph is created once here instead of every time the palette is opened
+            entry["ports"] = ports_to_manifest(MacroHelper._load_template(path).ports)
+            entry["dependencies"] = _dependencies(template)
+        except Exception as err:
+            # e.g. parameters without default, the file is listed nonetheless
+            logger.warning(f'Could not determine the ports of {path}: {err}')
+            entry["error"] = str(err)
+        return entry
+
+    # --- access ----------------
+    def _rel(self, path):
+        return os.path.relpath(os.path.realpath(path), self.folder) if os.path.isabs(path) else path
+
+    def describe(self, path):
+        return self.entries().get(self._rel(path))
+
+    def ports(self, path):
+        """
+        (in_fields, out_fields) of the file as the macro would expose them, None if unknown.
+        """
+        entry = self.describe(path)
+        if entry is None or entry['ports'] is None:
+            return None
+        return ports_from_manifest(entry['ports'])
+
+    def example_inits(self):
+        """
+        Settings to create each indexed macro with, e.g. for node palettes.
+        """
+        return [{"path": os.path.join(self.folder, rel), "name": entry['name']} for rel, entry in sorted(self.entries().items()) if entry['error'] is None]
+
+    def classes(self):
+        """
+        The generated macro class per indexed file, created from the index alone.
+        """
+        from ..macro import Macro
+        return {rel: Macro._get_class(os.path.join(self.folder, rel)) for rel, entry in sorted(self.entries().items()) if entry['error'] is None}
+
+
+# parsed index files by path, reloaded if they changed
+_indices = {}
+_indices_lock = threading.Lock()
+
+def _read_index(path):
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _indices_lock:
+        cached = _indices.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+    with open(path, 'r') as f:
+        index = json.load(f)
+    entries = index['entries'] if index.get('version') == INDEX_VERSION else {}
+    with _indices_lock:
+        _indices[path] = (mtime, entries)
+    return entries
+
+def library_manifest(template):
+    """
+    Port manifest of template from the index of a library it is part of, None if it is not indexed or changed since (including the macros nested in it).
+    """
+    path = template_cache.resolve(template.path)
+    folder = os.path.dirname(path)
+    while True:
+        entries = _read_index(os.path.join(folder, INDEX_FILE))
+        if entries is not None:
+            entry = entries.get(os.path.relpath(path, folder))
+            if entry is not None and entry['content_hash'] == template.content_hash and entry['ports'] is not None \
+                and all(os.path.exists(dep) and template_cache.get(dep).content_hash == content_hash for dep, content_hash in entry['dependencies'].items()):
+                return entry['ports']
+        parent = os.path.dirname(folder)
+        if parent == folder:
+            return None
+        folder = parent
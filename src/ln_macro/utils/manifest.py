@@ -0,0 +1,52 @@
+import os
+import importlib
+
+import yaml
+
+# the manifest is either embedded in the macro file under this key or stored next to it as <name>.ports.yml
+MANIFEST_KEY = 'Ports'
+
+def sidecar_path(path):
+    base, _ = os.path.splitext(path)
+    return f"{base}.ports.yml"
+
+def _port_class(name):
+    module, _, qualname = name.rpartition('.')
+    return getattr(importlib.import_module(module), qualname)
+
+def _port_name(port):
+    return f"{port.__class__.__module__}.{port.__class__.__qualname__}"
+
+def ports_to_manifest(ports):
+    in_fields, out_fields = ports
+    def encode(fields):
+        return [{"field": field_name, "port": _port_name(port), "key": port.key, "label": port.label, "optional": port.optional} for field_name, port in fields]
+    return {"in": encode(in_fields), "out": encode(out_fields)}
+
+def ports_from_manifest(manifest):
+    # only imports the port classes, none of the sub-graph's nodes
+    def decode(entries):
+        return [(e['field'], _port_class(e['port'])(e['label'], optional=e.get('optional', False), key=e['key'])) for e in entries]
+    return decode(manifest.get('in', [])), decode(manifest.get('out', []))
+
+def read_manifest(template):
+    """
+    Returns the port manifest for the template, or None if the macro file has none.
+    """
+    if MANIFEST_KEY in template.dct:
+        return template.dct[MANIFEST_KEY]
+    sidecar = sidecar_path(template.path)
+    if os.path.exists(sidecar):
+        with open(sidecar, 'r') as f:
+            return yaml.load(f, Loader=yaml.Loader)
+    return None
+
+def write_manifest(path, ports):
+    """
+    Writes the manifest for the ports of the macro file at path next to it, ie Macro(path, lazy=True) does not need to instantiate the sub-graph anymore.
+    Needs to be re-written whenever the exposed ports of the file change.
+    """
+    sidecar = sidecar_path(path)
+    with open(sidecar, 'w') as f:
+        yaml.dump(ports_to_manifest(ports), f, sort_keys=False)
+    return sidecar
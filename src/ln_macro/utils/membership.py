@@ -0,0 +1,48 @@
+class MacroMembership():
+    """
+    Record of the macros a node is part of (innermost first) and how it is exposed by the outermost one.
+    The name and port maps are resolved once per join, such that lookups cost the same at any nesting depth.
+    This is the only macro state kept on sub-graph nodes, pickling it keeps the ids, name and port maps but not the macros themselves.
+    """
+    __slots__ = ('macro_ids', 'name', 'ports_in', 'ports_out', '_macros')
+
+    def __init__(self):
+        self.macro_ids = []
+        # name of the node within the outermost macro, ie qualified by the inner macros' names
+        self.name = None
+        # port key of the node -> field name on the outermost macro
+        self.ports_in = {}
+        self.ports_out = {}
+        self._macros = []
+
+    def join(self, macro, name, ports_in, ports_out):
+        self.macro_ids.append(id(macro))
+        self._macros.append(macro)
+        # the outermost macro exposes all ports of the (flattened) sub-graph, thus it simply replaces the name and maps of inner ones
+        self.name = name
+        self.ports_in = ports_in
+        self.ports_out = ports_out
+
+    @property
+    def macros(self):
+        return self._macros
+
+    @property
+    def outer(self):
+        return self._macros[-1] if len(self._macros) > 0 else None
+
+    def __getstate__(self):
+        return self.macro_ids, self.name, self.ports_in, self.ports_out
+
+    def __setstate__(self, state):
+        self.macro_ids, self.name, self.ports_in, self.ports_out = state
+        # the macros stay in the process that created them
+        self._macros = []
+
+
+def membership(node):
+    return getattr(node, '_macro', None)
+
+def macro_parents(node):
+    record = membership(node)
+    return record.macros if record is not None else []
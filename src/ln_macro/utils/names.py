@@ -0,0 +1,102 @@
+from .membership import membership
+
+
+class MacroNameRegistry():
+    """
+    Names of all macros within one (connected) graph.
+    Registries of graphs that get connected are merged (union-find), so that uniqueness checks and suffix allocation do not need to compare against every macro of the graph again.
+    """
+
+    def __init__(self):
+        self._parent = None
+        self.macros = {}
+        # next free suffix per base name, so that allocating does not need to probe all previous suffixes again
+        self._counters = {}
+
+    def find(self):
+        root = self
+        while root._parent is not None:
+            root = root._parent
+        # path compression, so that following lookups are constant time again
+        node = self
+        while node._parent is not None and node._parent is not root:
+            node._parent, node = root, node._parent
+        return root
+
+    def is_unique(self, name, macro):
+        owner = self.macros.get(name)
+        return owner is None or owner is macro
+
+    def allocate(self, base, macro=None):
+        if self.is_unique(base, macro):
+            return base
+        # if the macro already holds a suffixed version of base, it may just keep it
+        current = getattr(macro, 'name', None)
+        if current is not None and current.startswith(f"{base}_") and current[len(base) + 1:].isdigit() and self.macros.get(current) is macro:
+            return current
+        i = self._counters.get(base, 2)
+        while not self.is_unique(f"{base}_{i}", macro):
+            i += 1
+        self._counters[base] = i + 1
+        return f"{base}_{i}"
+
+    def add(self, macro, name):
+        name = self.allocate(name, macro)
+        self.macros[name] = macro
+        return name
+
+    def remove(self, macro, name):
+        if self.macros.get(name) is macro:
+            del self.macros[name]
+
+    def rename(self, macro, old_name, new_name):
+        self.remove(macro, old_name)
+        return self.add(macro, new_name)
+
+    def merge(self, other):
+        """
+        Merge other into self. On conflicts the macros of other are renamed, as other is considered the newly added part of the graph.
+        Returns the root of the merged registry.
+        """
+        keep, new = self.find(), other.find()
+        if keep is new:
+            return keep
+
+        renames = [macro for name, macro in new.macros.items() if not keep.is_unique(name, macro)]
+        renamed_ids = set(map(id, renames))
+
+        # always move the smaller registry into the larger one
+        small, large = (new, keep) if len(new.macros) <= len(keep.macros) else (keep, new)
+        for name, macro in small.macros.items():
+            if id(macro) not in renamed_ids:
+                large.macros[name] = macro
+        for base, i in small._counters.items():
+            large._counters[base] = max(i, large._counters.get(base, 2))
+        small.macros = {}
+        small._counters = {}
+        small._parent = large
+
+        for macro in renames:
+            new_name = large.allocate(macro.name, macro)
+            macro.warn(f"{str(macro)} not unique in new graph. Renaming Node to: {new_name}")
+            # setting the name registers the macro in its (now merged) registry
+            macro.name = new_name
+        return large
+
+    @classmethod
+    def lookup(cls, node):
+        """
+        Returns the registry of the graph node is part of.
+        Registries are only kept on the macros, the graph is discovered to find all of them, as plain nodes may have joined their graphs in the meantime (e.g. via Node.add_input), which we do not get to know.
+        """
+        registry = None
+        seen = set()
+        for n in node.discover_graph(node, direction='both', sort=False):
+            # children are represented by their outermost macro, lazy macros are part of the graph themselves
+            macro = getattr(membership(n), 'outer', None) or n
+            found = macro.__dict__.get('_macro_names')
+            if found is None or id(macro) in seen:
+                continue
+            seen.add(id(macro))
+            registry = found.find() if registry is None else registry.merge(found)
+        return registry if registry is not None else cls()
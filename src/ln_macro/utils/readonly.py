@@ -0,0 +1,21 @@
+import numpy as np
+
+
+def readonly(data):
+    """
+    Read-only view of an array, such that it can be passed to several consumers without copying.
+    Anything but arrays is returned as is.
+    """
+    if isinstance(data, np.ndarray) and data.flags.writeable:
+        view = data.view()
+        view.flags.writeable = False
+        return view
+    return data
+
+def writable(data):
+    """
+    Copy-on-write for consumers that need to change received data: read-only arrays are copied, everything else is returned as is.
+    """
+    if isinstance(data, np.ndarray) and not data.flags.writeable:
+        return data.copy()
+    return data
@@ -0,0 +1,226 @@
+import os
+import re
+import json
+import copy
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
+from livenodes import Node
+
+import logging
+logger = logging.getLogger('livenodes')
+
+# defaults of the template's parameters, settings may reference them as ${name}
+PARAMS_KEY = 'Params'
+PLACEHOLDER = re.compile(r'\$\{(\w+)\}')
+
+# same semantics as yaml.Loader, but implemented in C if libyaml is available
+YAML_LOADER = getattr(yaml, 'CLoader', yaml.Loader)
+
+def macro_paths(dct, folder=None):
+    """
+    Paths of all macros referenced in a (compact) graph dict, relative paths are resolved against folder.
+    """
+    paths = []
+    for key, settings in (dct.get('Nodes') or {}).items():
+        if key.endswith('[Macro]') and isinstance(settings, dict) and isinstance(settings.get('path'), str):
+            path = settings['path']
+            if folder is not None and not os.path.isabs(path):
+                path = os.path.join(folder, path)
+            paths.append(path)
+    return paths
+
+
+class MacroTemplate():
+    """
+    Parsed description of a macro file.
+    Holds everything that is the same for every instance of a macro, so that instances can be created without re-reading and re-parsing the file.
+    """
+
+    def __init__(self, path, mtime, content_hash, dct):
+        self.path = path
+        self.mtime = mtime
+        self.content_hash = content_hash
+        self.dct = dct
+        # filled by the macro on first use, as only the macro knows how to turn the sub-graph into ports
+        # keyed by the resolved params (see ports_key), as parameters may change the sub-graph and thus the ports
+        self.variant_ports = {}
+        # whether the ports of the defaults were read from a manifest (see utils.manifest) instead of the instantiated sub-graph
+        self.from_manifest = False
+        # names of all ${name} placeholders in the file
+        self._placeholders = None
+
+    def __str__(self):
+        return f"<MacroTemplate: {self.path} ({self.content_hash[:8]})>"
+
+    @property
+    def params(self):
+        return self.dct.get(PARAMS_KEY) or {}
+
+    @property
+    def ports(self):
+        # ports of the template with its default params
+        return self.variant_ports.get(self.ports_key())
+
+    def ports_key(self, params=None):
+        # without placeholders the params cannot change the sub-graph, thus all instances share their ports
+        if len(self.placeholders()) == 0:
+            return ""
+        return json.dumps(self.resolve_params(params), sort_keys=True, default=str)
+
+    def ports_for(self, params=None):
+        return self.variant_ports.get(self.ports_key(params))
+
+    def resolve_params(self, params=None):
+        """
+        Defaults of the template updated by params, raises if params are given that the template does not declare.
+        """
+        params = params or {}
+        unknown = set(params) - set(self.params) - self.placeholders()
+        if len(unknown) > 0:
+            raise ValueError(f'Unknown parameters for {self.path}: {sorted(unknown)}')
+        return {**self.params, **params}
+
+    def placeholders(self):
+        if self._placeholders is None:
+            self._placeholders = set(PLACEHOLDER.findall(json.dumps({k: v for k, v in self.dct.items() if k != PARAMS_KEY}, default=str)))
+        return self._placeholders
+
+    def instantiate(self, params=None):
+        # copy, so that no node can change the cached description through its settings
+        dct = copy.deepcopy({k: v for k, v in self.dct.items() if k != PARAMS_KEY})
+        if len(self.placeholders()) > 0:
+            dct = self._substitute(dct, self.resolve_params(params))
+        if self.path.endswith('.json'):
+            return Node.from_dict(dct)
+        return Node.from_compact_dict(self._resolve_nested(dct))
+
+    def _substitute(self, value, params):
+        if isinstance(value, dict):
+            return {key: self._substitute(val, params) for key, val in value.items()}
+        if isinstance(value, list):
+            return [self._substitute(val, params) for val in value]
+        if not isinstance(value, str) or '${' not in value:
+            return value
+
+        def lookup(name):
+            if name not in params:
+                raise ValueError(f'No value for parameter {name} of {self.path}, pass it via params or declare a default under {PARAMS_KEY}')
+            return params[name]
+
+        # a placeholder that is the whole value keeps the parameter's type, otherwise it is formatted into the string
+        match = PLACEHOLDER.fullmatch(value)
+        if match is not None:
+            return lookup(match.group(1))
+        return PLACEHOLDER.sub(lambda m: str(lookup(m.group(1))), value)
+
+    def _resolve_nested(self, dct):
+        # relative paths of nested macros are relative to this file, such that macro libraries can be moved as a whole
+        folder = self.folder
+        for key, settings in dct.get('Nodes', {}).items():
+            if key.endswith('[Macro]') and 'path' in settings and not os.path.isabs(settings['path']):
+                settings['path'] = os.path.join(folder, settings['path'])
+        return dct
+
+    @property
+    def folder(self):
+        return os.path.dirname(os.path.realpath(self.path))
+
+
+class TemplateCache():
+    """
+    Process wide cache of parsed macro files keyed on the resolved path.
+    Entries are validated against the files mtime and, if that changed, against the content hash.
+    """
+
+    def __init__(self):
+        self._templates = {}
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def resolve(path):
+        return os.path.realpath(path)
+
+    @staticmethod
+    def _parse(path, content):
+        if path.endswith('.json'):
+            return json.loads(content)
+        elif path.endswith('.yml'):
+            return yaml.load(content, Loader=YAML_LOADER)
+        raise ValueError('Unkown Extension', path)
+
+    def get(self, path):
+        key = self.resolve(path)
+        mtime = os.stat(key).st_mtime_ns
+
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None and template.mtime == mtime:
+                self.hits += 1
+                return template
+
+        with open(key, 'rb') as f:
+            content = f.read()
+        content_hash = hashlib.sha1(content).hexdigest()
+
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None and template.content_hash == content_hash:
+                # the file was touched, but not changed -> keep the parsed version (and the ports that were already computed)
+                template.mtime = mtime
+                self.hits += 1
+                return template
+
+        # parse outside of the lock, so that different files can be loaded concurrently (see prefetch)
+        logger.info(f'Parsing macro template from {key}')
+        parsed = MacroTemplate(path, mtime, content_hash, self._parse(key, content.decode('utf-8')))
+
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None and template.content_hash == content_hash:
+                # someone else was faster, keep theirs as it may already have its ports
+                self.hits += 1
+                return template
+            self._templates[key] = parsed
+            self.misses += 1
+            return parsed
+
+    def prefetch(self, paths, max_workers=None):
+        """
+        Reads and parses the given macro files and all macros nested in them concurrently, each file only once.
+        Returns the templates by resolved path.
+        """
+        templates = {}
+        todo = list(dict.fromkeys(map(self.resolve, paths)))
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            # one level of nesting at a time, as we only know the nested files once their parents are parsed
+            while len(todo) > 0:
+                level = dict(zip(todo, pool.map(self.get, todo)))
+                templates.update(level)
+                nested = [self.resolve(p) for t in level.values() for p in macro_paths(t.dct, t.folder)]
+                todo = [key for key in dict.fromkeys(nested) if key not in templates]
+        return templates
+
+    def invalidate(self, path=None):
+        with self._lock:
+            if path is None:
+                self._templates = {}
+            else:
+                self._templates.pop(self.resolve(path), None)
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._templates)}
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+
+# There is one cache per process, such that all macros (including nested ones) share the parsed files
+template_cache = TemplateCache()
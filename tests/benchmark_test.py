@@ -0,0 +1,30 @@
+import json
+import pathlib
+import importlib.util
+
+# the benchmarks are a standalone script, not part of the package
+spec = importlib.util.spec_from_file_location("benchmarks_run", pathlib.Path(__file__).parent.parent / "benchmarks" / "run.py")
+run = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(run)
+
+
+class TestBenchmarks:
+
+    def test_construction(self, tmp_path):
+        results = list(run.bench_construction(str(tmp_path), [2], repeat=2))
+        assert [name for name, _, _ in results] == ["construction_cold", "construction"]
+        assert results[1][2]["repeat"] == 2
+
+    def test_serialization_nested(self, tmp_path):
+        results = list(run.bench_serialization(str(tmp_path), [2], repeat=1, nested=(1,)))
+        assert [(name, params) for name, params, _ in results] == [
+            ("to_compact_dict", {"macros": 2, "nested": 1}),
+            ("from_compact_dict", {"macros": 2, "nested": 1}),
+        ]
+
+    def test_compare(self):
+        old = {"results": [{"name": "a", "params": {"n": 1}, "stats": {"median": 2.0}}]}
+        new = {"results": [{"name": "a", "params": {"n": 1}, "stats": {"median": 1.0}}, {"name": "b", "params": {}, "stats": {"median": 1.0}}]}
+        ratios = run.compare(new, old)
+        assert ratios == [{"name": "a", "params": {"n": 1}, "stat": "median", "ratio": 0.5}]
+        json.dumps(ratios)
@@ -1,4 +1,9 @@
+import io
+import os
+import copy
 import numpy as np
+import pickle
+import pytest
 import logging
 
 logging.basicConfig(level=logging.DEBUG)
@@ -6,7 +11,8 @@ logging.basicConfig(level=logging.DEBUG)
 from livenodes import Graph, Node
 from ln_io_python.in_python import In_python
 from ln_io_python.out_python import Out_python
-from ln_macro import Macro, Noop, MacroHelper
+from ln_macro import Macro, Noop, MacroHelper, MacroGraph, template_cache, bulk_load
+from ln_macro.utils import MacroTemplate, MacroLibrary, write_manifest
 import yaml
 
 def build_pipeline(data=[100]):
@@ -18,6 +24,14 @@ def build_pipeline(data=[100]):
 
     return in_python, macro, out_python
 
+class NodePickler(pickle.Pickler):
+    # livenodes' synchronization primitives are only shared by inheritance, everything else of a node has to pickle
+    def persistent_id(self, obj):
+        return id(obj) if type(obj).__module__.split('.')[0] in ('multiprocessing', '_thread', 'threading', 'asyncio') else None
+
+def dump_node(node):
+    NodePickler(io.BytesIO()).dump(node)
+
 def run_single_test(data):
     in_python, macro, out_python = build_pipeline(data)
 
@@ -81,6 +95,56 @@ class TestProcessing:
         assert not macro.provides_input_to(out_python), 'Macro should not be connected to output anymore'
         assert not macro.nodes[1].provides_input_to(out_python), 'Node in macro should not be connected to output anymore'
 
+    def test_boundary_index(self):
+        in_python, macro, out_python = build_pipeline()
+        assert macro._boundary_in == in_python.output_connections
+        assert macro._boundary_out == out_python.input_connections
+
+        head, tail = macro._boundary_in[0]._recv_node, macro._boundary_out[0]._emit_node
+        out_python.remove_all_inputs()
+        assert macro._boundary_out == []
+        macro.remove_all_inputs()
+        assert macro._boundary_in == []
+        assert len(head.input_connections) == 0
+        assert len(tail.input_connections) == 1, 'Connections within the sub-graph are kept'
+
+    def test_membership(self):
+        in_python, macro, out_python = build_pipeline()
+        head = macro._boundary_in[0]._recv_node
+        assert 'compact_settings' not in vars(head), 'Children should not be patched per instance'
+        assert head._macro.outer is macro
+        assert head._macro.ports_in == {'any': 'Noop_any'}
+
+        record = pickle.loads(pickle.dumps(head._macro))
+        assert record.macro_ids == [id(macro)]
+        assert record.ports_in == head._macro.ports_in
+        assert record.ports_out == head._macro.ports_out
+        assert record.macros == []
+
+        # children stay what they were, livenodes itself is untouched
+        assert type(head).__name__ == 'Noop' and isinstance(head, Noop)
+        assert type(copy.copy(head)) is type(head)
+        assert head.__reduce_ex__(4)[1][0] is Noop
+        # connected children pickle without any of the macro's state
+        dump_node(head)
+        macro.instrument()
+        dump_node(head)
+        assert Node.compact_settings.__module__.startswith('livenodes')
+        assert Node.remove_input_by_connection.__module__.startswith('livenodes')
+        assert not hasattr(Node, 'get_name_resolve_macro')
+
+    def test_child_override(self):
+        class Custom(Noop):
+            def get_name_resolve_macro(self):
+                return "custom"
+
+        assert Custom(name="Plain").get_name_resolve_macro() == "custom"
+        macro = Macro(path=Macro.example_init["path"])
+        n = Custom(name="Custom")
+        macro._adopt(n, 'Custom', {}, {})
+        assert isinstance(n, Custom)
+        assert n.get_name_resolve_macro() == f"Custom({str(macro)})"
+
     def test_deconnectable_specific(self):
         in_python, macro, out_python = build_pipeline()
         assert not in_python.provides_input_to(macro), 'Macro itself should never be connected, as it\'s not processing anything'
@@ -111,6 +175,31 @@ class TestProcessing:
         macro2.add_input(in_python, emit_port=in_python.ports_out.any, recv_port=macro2.ports_in.Noop_any)
         assert macro2.name != macro.name
 
+    def test_unique_name_plain_join(self):
+        in1 = In_python(data=[100])
+        macro = Macro(path=Macro.example_init["path"])
+        macro.add_input(in1, emit_port=in1.ports_out.any, recv_port=macro.ports_in.Noop_any)
+        n2 = Noop(name="Plain")
+        n2.add_input(in1, emit_port=in1.ports_out.any, recv_port=n2.ports_in.any)
+        macro2 = Macro(path=Macro.example_init["path"])
+        macro2.add_input(n2, emit_port=n2.ports_out.any, recv_port=macro2.ports_in.Noop_any)
+        assert macro2.name != macro.name
+
+        # two graphs with a macro each, joined by a connection between plain nodes
+        in3 = In_python(data=[100])
+        macro3 = Macro(path=Macro.example_init["path"])
+        macro3.add_input(in3, emit_port=in3.ports_out.any, recv_port=macro3.ports_in.Noop_any)
+        n4 = Noop(name="Plain2")
+        macro4 = Macro(path=Macro.example_init["path"])
+        macro4.add_input(n4, emit_port=n4.ports_out.any, recv_port=macro4.ports_in.Noop_any)
+        assert macro3.name == macro4.name
+        n4.add_input(in3, emit_port=in3.ports_out.any, recv_port=n4.ports_in.any)
+        macro5 = Macro(path=Macro.example_init["path"])
+        macro5.add_input(n4, emit_port=n4.ports_out.any, recv_port=macro5.ports_in.Noop_any)
+        assert len(set([macro3.name, macro4.name, macro5.name])) == 3
+        names = [key for key in in3.to_compact_dict(graph=True)['Nodes'] if key.startswith('Macro')]
+        assert len(names) == 3
+
     def test_unique_name_on_set(self):
         in_python, macro, out_python = build_pipeline([100])
         macro2 = Macro(path=Macro.example_init["path"])
@@ -121,6 +210,24 @@ class TestProcessing:
         assert in_python.provides_input_to(macro.nodes[0])
         assert in_python.provides_input_to(macro2.nodes[0])
 
+    def test_unique_name_suffixes(self):
+        in_python, macro, out_python = build_pipeline([100])
+        macros = [Macro(path=Macro.example_init["path"]) for _ in range(3)]
+        for m in macros:
+            m.add_input(in_python, emit_port=in_python.ports_out.any, recv_port=m.ports_in.Noop_any)
+        assert [m.name for m in macros] == ['Macro:noop_2', 'Macro:noop_3', 'Macro:noop_4']
+
+    def test_unique_name_released_on_disconnect(self):
+        in_python, macro, out_python = build_pipeline([100])
+        macro2 = Macro(path=Macro.example_init["path"], name="Other")
+        macro2.add_input(in_python, emit_port=in_python.ports_out.any, recv_port=macro2.ports_in.Noop_any)
+        macro2._set_attr(name=macro.name)
+        assert macro2.name == 'Macro:noop_2'
+
+        macro2.remove_all_inputs()
+        macro2._set_attr(name=macro.name)
+        assert macro2.name == macro.name, 'Disconnected macros are no longer part of the graph'
+
     def test_chain(self):
         in_python, macro, out_python = build_pipeline([100])
         macro2 = macro.__class__(path=Macro.example_init["path"])
@@ -136,7 +243,7 @@ class TestProcessing:
         dct = in_python.to_compact_dict(graph=True)
         assert set(dct['Inputs']) == set(['Python Input [In_python].any -> Macro:noop [Macro].Noop_any', 
             'Macro:noop [Macro].Noop2_any -> Python Output [Out_python].any',
-            'Macro:noop [Macro].Noop2_any -> Macro:noop_1 [Macro].Noop_any'])
+            'Macro:noop [Macro].Noop2_any -> Macro:noop_2 [Macro].Noop_any'])
         
         macro2.remove_input(emit_node=macro, emit_port=macro.ports_out.Noop2_any, recv_port=macro2.ports_in.Noop_any)
         assert not in_python.provides_input_to(macro2.nodes[0])
@@ -174,6 +281,37 @@ class TestProcessing:
         assert '[Macro]' in serialized_output
         assert '[Noop]' not in serialized_output
 
+    def test_serialize_cached(self, monkeypatch, capsys):
+        in_python, macro, out_python = build_pipeline()
+        dct = in_python.to_compact_dict(graph=True)
+
+        calls, settings_calls = [], []
+        adjust = MacroHelper.adjust
+        monkeypatch.setattr(MacroHelper, 'adjust', staticmethod(lambda *args, **kwargs: calls.append(args) or adjust(*args, **kwargs)))
+        node_settings = MacroHelper._node_settings
+        monkeypatch.setattr(MacroHelper, '_node_settings', lambda self: settings_calls.append(self) or node_settings(self))
+        assert in_python.to_compact_dict(graph=True) == dct
+        assert len(calls) == 0, 'Unchanged macros should not be serialized again'
+        assert len(settings_calls) == 0, 'Unchanged settings should not be collected again'
+        assert capsys.readouterr().out == ''
+
+        macro.remove_all_inputs()
+        assert "Python Input [In_python].any -> Macro:noop [Macro].Noop_any" not in macro.to_compact_dict(graph=True)['Inputs']
+        macro.add_input(in_python, emit_port=in_python.ports_out.any, recv_port=macro.ports_in.Noop_any)
+        assert in_python.to_compact_dict(graph=True) == dct
+        assert len(calls) > 0
+        macro._set_attr(compute_on="1:1")
+        assert in_python.to_compact_dict(graph=True)['Nodes']['Macro:noop [Macro]']['compute_on'] == "1:1"
+        assert len(settings_calls) == 1
+        calls.clear()
+
+        in_python.name = "Renamed Input"
+        macro.name = "Renamed Macro"
+        dct = in_python.to_compact_dict(graph=True)
+        assert len(calls) > 0
+        assert "Renamed Input [In_python].any -> Renamed Macro [Macro].Noop_any" in dct['Inputs']
+        assert "Renamed Macro [Macro].Noop2_any -> Python Output [Out_python].any" in dct['Inputs']
+
     def test_deserialize(self):
         data = [100]
         # double check the graph is working in the first place
@@ -203,6 +341,263 @@ class TestProcessing:
 
 
 
+    def test_class_reused(self):
+        a = Macro(path=Macro.example_init["path"])
+        b = Macro(path=Macro.example_init["path"], name="Other")
+        assert a.__class__ is b.__class__
+        assert a.ports_in is b.ports_in
+        assert a.example_init is not MacroHelper.example_init
+        assert a.example_init["name"] == "Macro:noop"
+
+    def test_template_cache(self):
+        template_cache.invalidate()
+        template_cache.reset_stats()
+        a = Macro(path=Macro.example_init["path"])
+        assert template_cache.stats() == {"hits": 1, "misses": 1, "size": 1}
+        b = Macro(path=Macro.example_init["path"])
+        assert template_cache.stats() == {"hits": 3, "misses": 1, "size": 1}
+        assert a.nodes[0] is not b.nodes[0], 'Each macro needs its own sub-graph instances'
+
+        template_cache.invalidate(Macro.example_init["path"])
+        assert template_cache.stats()["size"] == 0
+        Macro(path=Macro.example_init["path"])
+        assert template_cache.stats()["misses"] == 2
+
+    def test_template_cache_file_change(self, tmp_path):
+        path = str(tmp_path / "macro.yml")
+        with open(Macro.example_init["path"], 'r') as f:
+            content = f.read()
+        with open(path, 'w') as f:
+            f.write(content)
+        a = Macro(path=path)
+        assert len(a.ports_out) == 2
+
+        with open(path, 'w') as f:
+            f.write(content.replace('Noop2', 'Noop3'))
+        # make sure the change is detected, even if the file system's mtime resolution is coarse
+        os.utime(path, ns=(0, 0))
+        b = Macro(path=path)
+        assert b.ports_out._fields == ['Noop3_any', 'Noop_any']
+
+    def test_reload(self, tmp_path):
+        path = str(tmp_path / "macro.yml")
+        with open(Macro.example_init["path"], 'r') as f:
+            content = yaml.load(f, Loader=yaml.Loader)
+        with open(path, 'w') as f:
+            yaml.dump(content, f)
+
+        in_python = In_python(data=[100])
+        macro = Macro(path=path)
+        macro.add_input(in_python, emit_port=in_python.ports_out.any, recv_port=macro.ports_in.Noop_any)
+        out_python = Out_python()
+        out_python.add_input(macro, emit_port=macro.ports_out.Noop2_any, recv_port=out_python.ports_in.any)
+        noop, noop2 = macro.own_in_port_to_ref['Noop_any'][0], macro.own_out_port_to_ref['Noop2_any'][0]
+
+        content['Inputs'].append('Noop2 [Noop].any -> Noop3 [Noop].any')
+        content['Nodes']['Noop3 [Noop]'] = {'compute_on': '', 'name': 'Noop3'}
+        with open(path, 'w') as f:
+            yaml.dump(content, f)
+        os.utime(path, ns=(0, 0))
+        assert macro.reload() == {"replaced": [], "added": ['Noop3'], "removed": []}
+        assert macro.own_in_port_to_ref['Noop_any'][0] is noop and macro.own_out_port_to_ref['Noop2_any'][0] is noop2, 'Unchanged children are kept'
+        assert macro.ports_out._fields == ['Noop2_any', 'Noop3_any', 'Noop_any']
+        assert macro.own_out_port_to_ref['Noop3_any'][0]._macro.outer is macro
+        assert in_python.provides_input_to(noop) and noop2.provides_input_to(out_python), 'Connections on unchanged ports are kept'
+        assert 'Macro:macro [Macro].Noop2_any -> Python Output [Out_python].any' in in_python.to_compact_dict(graph=True)['Inputs']
+
+        g = Graph(start_node=in_python)
+        g.start_all()
+        g.join_all()
+        g.stop_all()
+        np.testing.assert_equal(out_python.get_state(), [100])
+
+        content['Inputs'] = ['Noop [Noop].any -> Noop3 [Noop].any']
+        del content['Nodes']['Noop2 [Noop]']
+        with open(path, 'w') as f:
+            yaml.dump(content, f)
+        os.utime(path, ns=(1, 1))
+        assert macro.reload() == {"replaced": [], "added": [], "removed": ['Noop2']}
+        assert macro.ports_out._fields == ['Noop3_any', 'Noop_any']
+        assert len(out_python.input_connections) == 0, 'Connections on ports that are gone are removed'
+        assert macro._boundary_out == []
+        dct = in_python.to_compact_dict(graph=True)
+        assert dct['Inputs'] == ['Python Input [In_python].any -> Macro:macro [Macro].Noop_any']
+        assert Node.from_compact_dict(dct).to_compact_dict(graph=True) == dct
+
+    def test_bulk_load(self):
+        nested = Macro.example_init["path"].replace('noop.yml', 'noop_nested.yml')
+        in_python = In_python(data=[100])
+        prev, port = in_python, in_python.ports_out.any
+        for path in [Macro.example_init["path"], nested, Macro.example_init["path"]]:
+            m = Macro(path=path)
+            m.add_input(prev, emit_port=port, recv_port=getattr(m.ports_in, m.ports_in._fields[0]))
+            prev, port = m, getattr(m.ports_out, m.ports_out._fields[0])
+        dct = in_python.to_compact_dict(graph=True)
+
+        template_cache.invalidate()
+        templates = template_cache.prefetch([Macro.example_init["path"], nested, Macro.example_init["path"]], max_workers=2)
+        assert set(templates) == set(map(template_cache.resolve, [Macro.example_init["path"], nested])), 'Nested files are loaded and duplicates only once'
+
+        template_cache.invalidate()
+        template_cache.reset_stats()
+        s = bulk_load(dct)
+        assert template_cache.stats()["misses"] == 2
+        assert s.to_compact_dict(graph=True) == dct
+
+    def test_manifest(self, tmp_path, monkeypatch):
+        path = str(tmp_path / "macro.yml")
+        with open(Macro.example_init["path"], 'r') as f:
+            content = f.read()
+        with open(path, 'w') as f:
+            f.write(content)
+        write_manifest(path, Macro._load_template(Macro.example_init["path"]).ports)
+
+        instantiated = []
+        instantiate = MacroTemplate.instantiate
+        monkeypatch.setattr(MacroTemplate, 'instantiate', lambda self, *args: instantiated.append(self) or instantiate(self, *args))
+        a = Macro(path=path, lazy=True)
+        assert a.ports_in._fields == ['Noop_any']
+        assert a.ports_out._fields == ['Noop2_any', 'Noop_any']
+        assert len(instantiated) == 0, 'Neither the class nor the lazy instance should create the sub-graph'
+        assert len(a.nodes) == 2
+        assert len(instantiated) == 1
+
+    def test_library(self, tmp_path, monkeypatch):
+        with open(Macro.example_init["path"], 'r') as f:
+            content = f.read()
+        os.makedirs(tmp_path / "sub")
+        for rel in ["a.yml", "sub/b.yml"]:
+            with open(tmp_path / rel, 'w') as f:
+                f.write(content)
+
+        library = MacroLibrary(str(tmp_path))
+        assert library.scan() == {"added": ["a.yml", "sub/b.yml"], "updated": [], "removed": []}
+        assert library.scan() == {"added": [], "updated": [], "removed": []}
+        entry = library.describe(str(tmp_path / "a.yml"))
+        assert entry["name"] == "Macro:a"
+        assert entry["classes"] == ["Noop"]
+        in_fields, out_fields = library.ports("a.yml")
+        assert [f for f, _ in out_fields] == ['Noop2_any', 'Noop_any']
+        assert out_fields[0][1].label == 'Noop2: Any'
+
+        # e.g. a new process, which only has the index
+        template_cache.invalidate()
+        instantiated = []
+        instantiate = MacroTemplate.instantiate
+        monkeypatch.setattr(MacroTemplate, 'instantiate', lambda self, *args: instantiated.append(self) or instantiate(self, *args))
+        classes = MacroLibrary(str(tmp_path)).classes()
+        assert classes["sub/b.yml"].ports_in._fields == ['Noop_any']
+        assert len(Macro(path=str(tmp_path / "a.yml"), lazy=True).ports_out) == 2
+        assert len(instantiated) == 0, 'Ports are taken from the index'
+
+        with open(tmp_path / "sub/b.yml", 'w') as f:
+            f.write(content.replace('Noop2', 'Noop3'))
+        os.utime(tmp_path / "sub/b.yml", ns=(0, 0))
+        os.remove(tmp_path / "a.yml")
+        assert library.scan() == {"added": [], "updated": ["sub/b.yml"], "removed": ["a.yml"]}
+        assert library.example_inits() == [{"path": str(tmp_path / "sub/b.yml"), "name": "Macro:b"}]
+        assert Macro(path=str(tmp_path / "sub/b.yml")).ports_out._fields == ['Noop3_any', 'Noop_any']
+
+    def test_params(self, tmp_path):
+        path = str(tmp_path / "source.yml")
+        with open(path, 'w') as f:
+            yaml.dump({
+                "Params": {"data": [1, 2]},
+                "Inputs": ["Source [In_python].any -> Noop [Noop].any"],
+                "Nodes": {"Source [In_python]": {"compute_on": "", "name": "Source", "data": "${data}"}, "Noop [Noop]": {"compute_on": "", "name": "Noop"}},
+            }, f)
+
+        template_cache.reset_stats()
+        outputs = []
+        macros = [Macro(path=path), Macro(path=path, params={"data": [3, 4, 5]})]
+        assert macros[0].__class__ is macros[1].__class__, 'Variants share the class'
+        assert template_cache.stats()["misses"] == 1, 'Variants share the template'
+        for macro in macros:
+            out_python = Out_python()
+            out_python.add_input(macro, emit_port=macro.ports_out.Noop_any, recv_port=out_python.ports_in.any)
+            outputs.append(out_python)
+            g = Graph(start_node=out_python)
+            g.start_all()
+            g.join_all()
+            g.stop_all()
+        np.testing.assert_equal(outputs[0].get_state(), [1, 2])
+        np.testing.assert_equal(outputs[1].get_state(), [3, 4, 5])
+
+        dct = outputs[1].to_compact_dict(graph=True)
+        assert dct['Nodes']['Macro:source [Macro]']['params'] == {"data": [3, 4, 5]}
+        assert set(dct['Nodes']['Macro:source [Macro]']) == {"name", "compute_on", "path", "params"}, 'Only options that are set are serialized'
+        assert macros[0]._settings() == {"path": path, "name": macros[0].name}
+        with pytest.raises(ValueError):
+            Macro(path=path, params={"unknown": 1})
+
+    def test_params_ports(self, tmp_path):
+        path = str(tmp_path / "order.yml")
+        with open(path, 'w') as f:
+            yaml.dump({
+                "Params": {"first": "A", "second": "B"},
+                "Inputs": ["${first} [Noop].any -> ${second} [Noop].any"],
+                "Nodes": {"A [Noop]": {"compute_on": "", "name": "A"}, "B [Noop]": {"compute_on": "", "name": "B"}},
+            }, f)
+
+        # the variant is created first, the defaults still get their own ports
+        swapped = Macro(path=path, params={"first": "B", "second": "A"})
+        default = Macro(path=path)
+        assert swapped.ports_in._fields == ['B_any']
+        assert default.ports_in._fields == ['A_any']
+        assert swapped.__class__ is not default.__class__, 'Variants with other ports get their own class'
+        assert Macro(path=path, params={"second": "B"}).__class__ is default.__class__
+        assert Macro(path=path, params={"first": "B", "second": "A"}).__class__ is swapped.__class__
+
+        in_python = In_python(data=[1, 2])
+        swapped.add_input(in_python, emit_port=in_python.ports_out.any, recv_port=swapped.ports_in.B_any)
+        out_python = Out_python()
+        out_python.add_input(swapped, emit_port=swapped.ports_out.A_any, recv_port=out_python.ports_in.any)
+        g = Graph(start_node=in_python)
+        g.start_all()
+        g.join_all()
+        g.stop_all()
+        np.testing.assert_equal(out_python.get_state(), [1, 2])
+
+    def test_lazy(self):
+        in_python = In_python(data=[100])
+        macro = Macro(path=Macro.example_init["path"], lazy=True)
+        macro.add_input(in_python, emit_port=in_python.ports_out.any, recv_port=macro.ports_in.Noop_any)
+        out_python = Out_python()
+        out_python.add_input(macro, emit_port=macro.ports_out.Noop2_any, recv_port=out_python.ports_in.any)
+        assert macro._lazy
+        assert in_python.provides_input_to(macro), 'Lazy macros are connected themselves'
+
+        dct = in_python.to_compact_dict(graph=True)
+        assert "Python Input [In_python].any -> Macro:noop [Macro].Noop_any" in dct['Inputs']
+
+        g = MacroGraph(start_node=in_python)
+        assert not macro._lazy
+        assert not any(isinstance(n, MacroHelper) for n in g.nodes)
+        assert in_python.provides_input_to(macro.nodes[0])
+        assert dct == in_python.to_compact_dict(graph=True), 'Lazy and created macros serialize the same'
+
+        g.start_all()
+        g.join_all()
+        g.stop_all()
+        np.testing.assert_equal(out_python.get_state(), [100])
+
+    def test_lazy_plain_graph(self):
+        in_python = In_python(data=[100])
+        macro = Macro(path=Macro.example_init["path"], lazy=True)
+        macro.add_input(in_python, emit_port=in_python.ports_out.any, recv_port=macro.ports_in.Noop_any)
+        out_python = Out_python()
+        out_python.add_input(macro, emit_port=macro.ports_out.Noop2_any, recv_port=out_python.ports_in.any)
+
+        with pytest.raises(ValueError, match="MacroGraph"):
+            Graph(start_node=in_python).start_all()
+
+        macro.materialize()
+        g = Graph(start_node=in_python)
+        g.start_all()
+        g.join_all()
+        g.stop_all()
+        np.testing.assert_equal(out_python.get_state(), [100])
+
     def test_compute_on(self):
         macro = Macro(path=Macro.example_init["path"], compute_on="1:2")
         assert macro.compute_on == "1:2"
@@ -211,5 +606,50 @@ class TestProcessing:
             assert n.compute_on == "1:2"
     
     
-    # def test_nested_macro(self):
-    #     macro = Macro(path=Macro.example_init["path"].replace('noop.yaml', 'noop_nested.yaml'))
\ No newline at end of file
+    def test_nested_macro(self):
+        path = Macro.example_init["path"].replace('noop.yml', 'noop_nested.yml')
+        macro = Macro(path=path)
+        assert macro.ports_in._fields == ['Noop_any']
+        assert macro.ports_out._fields == ['Inner_Noop2_any', 'Inner_Noop_any', 'Noop_any'], 'Nodes of nested macros are qualified by the nested macro\'s name'
+        assert len(macro.nodes) == 3
+        for n in macro.nodes:
+            assert n._macro.outer is macro
+
+        in_python = In_python(data=[100])
+        macro.add_input(in_python, emit_port=in_python.ports_out.any, recv_port=macro.ports_in.Noop_any)
+        out_python = Out_python()
+        out_python.add_input(macro, emit_port=macro.ports_out.Inner_Noop2_any, recv_port=out_python.ports_in.any)
+
+        dct = in_python.to_compact_dict(graph=True)
+        assert list(sorted(dct['Nodes'].keys())) == ['Macro:noop_nested [Macro]', 'Python Input [In_python]', 'Python Output [Out_python]']
+        assert set(dct['Inputs']) == set(['Python Input [In_python].any -> Macro:noop_nested [Macro].Noop_any',
+            'Macro:noop_nested [Macro].Inner_Noop2_any -> Python Output [Out_python].any'])
+
+        s = Node.from_compact_dict(dct)
+        assert s.to_compact_dict(graph=True) == dct
+
+        g = Graph(start_node=in_python)
+        g.start_all()
+        g.join_all()
+        g.stop_all()
+        np.testing.assert_equal(out_python.get_state(), [100])
+
+    def test_nested_macro_deep(self, tmp_path):
+        path = Macro.example_init["path"]
+        for depth in range(3):
+            outer = str(tmp_path / f"nested_{depth}.yml")
+            with open(outer, 'w') as f:
+                yaml.dump({
+                    "Inputs": ["Head [Noop].any -> Inner [Macro].Noop_any" if depth == 0 else "Head [Noop].any -> Inner [Macro].Head_any"],
+                    "Nodes": {"Head [Noop]": {"compute_on": "", "name": "Head"}, "Inner [Macro]": {"compute_on": "", "name": "Inner", "path": path, "lazy": depth == 1}},
+                }, f)
+            path = outer
+
+        macro = Macro(path=path)
+        assert 'Inner_Inner_Inner_Noop2_any' in macro.ports_out._fields
+        head = macro.own_in_port_to_ref['Head_any'][0]
+        tail = macro.own_out_port_to_ref['Inner_Inner_Inner_Noop2_any'][0]
+        assert MacroHelper._outer(tail, tail.ports_out.any, in_ports=False) == (macro, macro.ports_out.Inner_Inner_Inner_Noop2_any)
+        assert head._macro.outer is tail._macro.outer is macro
+        assert len(tail._macro.macros) == 4
+        assert tail.get_name_resolve_macro() == f"Inner_Inner_Inner_Noop2({str(macro)})"